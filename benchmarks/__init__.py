@@ -0,0 +1 @@
+"Benchmarks of TangoFS and its parts, runnable without a Tango system"
@@ -0,0 +1,402 @@
+"""
+In-memory stand-ins for the Tango database and device proxies, so
+that TangoFS can be measured without a control system.
+
+A FakeTango holds a synthetic tree of servers, devices, properties
+and attributes, of configurable size. It hands out a FakeDatabase and
+FakeDeviceProxy objects that answer the calls TangoFS makes, after an
+optional delay to simulate network latency, and counts every call.
+
+    tango = FakeTango(servers=5, devices=10, db_latency=0.001)
+    fs = tango.mount(bulk_index=True)  # a TangoFS using the fakes
+    fs.readdir("/devices", 0)
+    print tango.calls
+"""
+
+from collections import Counter
+from fnmatch import fnmatch
+import logging
+from threading import Lock
+from time import sleep, strftime, time
+
+import numpy as np
+import PyTango
+
+from tangofs import tangodict
+from tangofs.tangodict import ObjectWrapper
+from tangofs.tangofs import TangoFS
+
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class Datum(object):
+
+    "Like PyTango.DbDatum, as far as TangoFS cares"
+
+    def __init__(self, name="", value_string=()):
+        self.name = name
+        self.value_string = list(value_string)
+
+
+class Info(object):
+
+    "A bag of attributes, like the various Tango info structs"
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class History(object):
+
+    "Like PyTango.DbHistory"
+
+    def __init__(self, name, value, deleted=False):
+        self._name = name
+        self._value = list(value)
+        self._date = strftime(DATE_FORMAT)
+        self._deleted = deleted
+
+    def get_name(self):
+        return self._name
+
+    def get_date(self):
+        return self._date
+
+    def get_value(self):
+        return Datum(self._name, self._value)
+
+    def is_deleted(self):
+        return self._deleted
+
+
+class TimeVal(object):
+
+    def __init__(self, timestamp):
+        self._timestamp = timestamp
+
+    def totime(self):
+        return self._timestamp
+
+
+class Reading(object):
+
+    "Like PyTango.DeviceAttribute, the result of reading an attribute"
+
+    has_failed = False
+
+    def __init__(self, name, value, timestamp):
+        self.name = name
+        self.value = value
+        self.w_value = value
+        self.time = TimeVal(timestamp)
+        self.quality = PyTango.AttrQuality.ATTR_VALID
+
+
+def attribute_info(name, data_format, data_type, dim_x=1, dim_y=0,
+                   writable=PyTango.AttrWriteType.READ):
+    return Info(name=name, data_format=data_format, data_type=data_type,
+                writable=writable, disp_level=PyTango.DispLevel.OPERATOR,
+                max_dim_x=dim_x, max_dim_y=dim_y, label=name, unit="mm",
+                description="A fake attribute", format="%6.2f",
+                min_value="Not specified", max_value="Not specified")
+
+
+class FakeTango(object):
+
+    """A synthetic control system. There are `servers` servers, each
+    with `instances` instances of one class, each having `devices`
+    devices named dom<server>/fam<instance>/dev<n>. Each device has
+    `properties` properties, `attributes` scalar attributes and, unless
+    their sizes are 0, a spectrum and an image attribute.
+
+    Every call to the database or a device sleeps for db_latency or
+    device_latency seconds, and is counted in self.calls."""
+
+    def __init__(self, servers=5, instances=2, devices=10, properties=10,
+                 attributes=20, spectrum_size=1000, image_size=(256, 256),
+                 db_latency=0.0, device_latency=0.0):
+        self.db_latency = db_latency
+        self.device_latency = device_latency
+        self.calls = Counter()
+        self._lock = Lock()
+        self.devices = {}  # name -> (server/instance, class)
+        self.properties = {}  # device name -> {name: [lines]}
+        self.histories = {}  # device name -> [History]
+        for s in range(servers):
+            for i in range(instances):
+                server = "BenchServer%d/i%d" % (s, i)
+                for d in range(devices):
+                    name = "dom%d/fam%d/dev%d" % (s, i, d)
+                    self.devices[name] = (server, "BenchClass%d" % s)
+                    props = dict(("Property%d" % p, ["value %d" % p, name])
+                                 for p in range(properties))
+                    self.properties[name] = props
+                    self.histories[name] = [History(p, v)
+                                            for p, v in sorted(props.items())]
+        self.attributes = self._make_attributes(attributes, spectrum_size,
+                                                image_size)
+
+    @staticmethod
+    def _make_attributes(n, spectrum_size, image_size):
+        "name -> (info, function of time giving the value)"
+        fmt = PyTango.AttrDataFormat
+        types = PyTango.CmdArgType
+        attrs = {}
+        for i in range(n):
+            if i % 3 == 0:
+                info = attribute_info("Scalar%d" % i, fmt.SCALAR,
+                                      types.DevDouble)
+                attrs[info.name] = (info, lambda t, i=i: np.sin(t + i))
+            elif i % 3 == 1:
+                info = attribute_info("Counter%d" % i, fmt.SCALAR,
+                                      types.DevLong)
+                attrs[info.name] = (info, lambda t, i=i: int(t) + i)
+            else:
+                info = attribute_info("Text%d" % i, fmt.SCALAR,
+                                      types.DevString)
+                attrs[info.name] = (info, lambda t, i=i: "text %d" % i)
+        if spectrum_size:
+            info = attribute_info("Spectrum", fmt.SPECTRUM, types.DevDouble,
+                                  dim_x=spectrum_size)
+            spectrum = np.linspace(0, 1, spectrum_size)
+            attrs[info.name] = (info, lambda t: spectrum * np.cos(t))
+        if image_size and all(image_size):
+            height, width = image_size
+            info = attribute_info("Image", fmt.IMAGE, types.DevUShort,
+                                  dim_x=width, dim_y=height)
+            image = np.arange(height * width, dtype=np.uint16).reshape(
+                height, width)
+            attrs[info.name] = (info, lambda t: image + int(t))
+        return attrs
+
+    @classmethod
+    def from_options(cls, options):
+        "Make one from command line options, see add_tree_options()"
+        return cls(servers=options.servers, instances=options.instances,
+                   devices=options.devices, properties=options.properties,
+                   attributes=options.attributes,
+                   spectrum_size=options.spectrum,
+                   image_size=(options.image, options.image),
+                   db_latency=options.db_latency / 1000,
+                   device_latency=options.device_latency / 1000)
+
+    def call(self, name, latency):
+        "Count a backend call and wait for it to 'complete'"
+        with self._lock:
+            self.calls[name] += 1
+        if latency:
+            sleep(latency)
+
+    def get_database(self):
+        return ObjectWrapper(FakeDatabase(self),
+                             logger=logging.getLogger("tangodb"))
+
+    def get_proxy(self, devicename):
+        return ObjectWrapper(
+            FakeDeviceProxy(self, devicename),
+            logger=logging.getLogger("DeviceProxy(%s)" % devicename))
+
+    def mount(self, **kwargs):
+        """Return a TangoFS talking to this control system. The device
+        proxies are process wide, so this replaces them for everyone."""
+        tangodict.proxies.factory = self.get_proxy
+        for name in self.devices:
+            tangodict.proxies.discard(name)
+        return TangoFS(db=self.get_database(), **kwargs)
+
+
+def add_tree_options(parser):
+    "Add options for the size and speed of a FakeTango to an OptionParser"
+    parser.add_option("--servers", type="int", default=5)
+    parser.add_option("--instances", type="int", default=2,
+                      help="per server")
+    parser.add_option("--devices", type="int", default=10,
+                      help="per server instance")
+    parser.add_option("--properties", type="int", default=10,
+                      help="per device")
+    parser.add_option("--attributes", type="int", default=20,
+                      help="scalar attributes per device")
+    parser.add_option("--spectrum", type="int", default=1000,
+                      help="spectrum attribute size, 0 for none")
+    parser.add_option("--image", type="int", default=256,
+                      help="image attribute side, 0 for none")
+    parser.add_option("--db-latency", type="float", default=1.0,
+                      metavar="MS", help="delay of each database call")
+    parser.add_option("--device-latency", type="float", default=1.0,
+                      metavar="MS", help="delay of each device call")
+
+
+class FakeDatabase(object):
+
+    "Answers the PyTango.Database calls made by TangoFS"
+
+    def __init__(self, tango):
+        self._tango = tango
+
+    def _call(self, name):
+        self._tango.call("Database." + name, self._tango.db_latency)
+
+    def _device(self, name):
+        for devname in self._tango.devices:
+            if devname.lower() == name.lower():
+                return devname
+        raise PyTango.DevFailed("No device %s" % name)
+
+    def get_device_name(self, server, cls):
+        self._call("get_device_name")
+        return Datum(value_string=sorted(
+            name for name, (srv, clss) in self._tango.devices.items()
+            if fnmatch(srv.lower(), server.lower())
+            and fnmatch(clss.lower(), cls.lower())))
+
+    def _device_parts(self, pattern, level):
+        parts = set()
+        for name in self._tango.devices:
+            if fnmatch(name, pattern):
+                parts.add(name.split("/")[level])
+        return Datum(value_string=sorted(parts))
+
+    def get_device_domain(self, pattern):
+        self._call("get_device_domain")
+        return self._device_parts(pattern + "/*/*", 0)
+
+    def get_device_family(self, pattern):
+        self._call("get_device_family")
+        return self._device_parts(pattern + "/*", 1)
+
+    def get_device_member(self, pattern):
+        self._call("get_device_member")
+        return self._device_parts(pattern, 2)
+
+    def get_server_name_list(self):
+        self._call("get_server_name_list")
+        return Datum(value_string=sorted(set(
+            srv.split("/")[0] for srv, _ in self._tango.devices.values())))
+
+    def get_instance_name_list(self, server):
+        self._call("get_instance_name_list")
+        return Datum(value_string=sorted(set(
+            srv.split("/")[1] for srv, _ in self._tango.devices.values()
+            if srv.split("/")[0].lower() == server.lower())))
+
+    def get_server_class_list(self, server):
+        self._call("get_server_class_list")
+        return Datum(value_string=sorted(set(
+            cls for srv, cls in self._tango.devices.values()
+            if srv.lower() == server.lower())))
+
+    def get_server_info(self, server):
+        self._call("get_server_info")
+        return Info(name=server, host="localhost", mode=1, level=0)
+
+    def get_device_info(self, name):
+        self._call("get_device_info")
+        server, cls = self._tango.devices[self._device(name)]
+        return Info(name=name, class_name=cls, ds_full_name=server,
+                    exported=True, pid=1234, started_date="today",
+                    stopped_date="")
+
+    def get_device_property_list(self, name, pattern):
+        self._call("get_device_property_list")
+        props = self._tango.properties[self._device(name)]
+        return Datum(value_string=sorted(p for p in props
+                                         if fnmatch(p, pattern)))
+
+    def get_device_property(self, name, names):
+        self._call("get_device_property")
+        props = self._tango.properties[self._device(name)]
+        if isinstance(names, basestring):
+            names = [names]
+        return dict((n, list(props.get(n, []))) for n in names)
+
+    def get_device_property_history(self, name, pattern):
+        self._call("get_device_property_history")
+        return [hist for hist in self._tango.histories[self._device(name)]
+                if fnmatch(hist.get_name(), pattern)]
+
+    def put_device_property(self, name, props):
+        self._call("put_device_property")
+        name = self._device(name)
+        for prop, value in props.items():
+            if isinstance(value, basestring):
+                value = [value]
+            self._tango.properties[name][prop] = list(value)
+            self._tango.histories[name].append(History(prop, value))
+
+    def delete_device_property(self, name, props):
+        self._call("delete_device_property")
+        name = self._device(name)
+        if isinstance(props, basestring):
+            props = [props]
+        for prop in props:
+            self._tango.properties[name].pop(prop, None)
+            self._tango.histories[name].append(History(prop, [], True))
+
+
+class FakeDeviceProxy(object):
+
+    "Answers the PyTango.DeviceProxy calls made by TangoFS"
+
+    def __init__(self, tango, devicename):
+        self._tango = tango
+        self._name = devicename
+
+    def _call(self, name):
+        self._tango.call("DeviceProxy." + name, self._tango.device_latency)
+
+    def _read(self, name):
+        for attrname, (info, value) in self._tango.attributes.items():
+            if attrname.lower() == name.lower():
+                now = time()
+                return Reading(attrname, value(now), now)
+        raise PyTango.DevFailed("No attribute %s" % name)
+
+    def ping(self):
+        self._call("ping")
+        return 100
+
+    def get_attribute_list(self):
+        self._call("get_attribute_list")
+        return sorted(self._tango.attributes)
+
+    def get_attribute_config(self, names):
+        self._call("get_attribute_config")
+        attrs = self._tango.attributes
+        if isinstance(names, basestring):
+            return attrs[names][0]
+        return [attrs[name][0] for name in names]
+
+    def read_attribute(self, name, *args):
+        self._call("read_attribute")
+        return self._read(name)
+
+    def read_attributes(self, names, *args):
+        self._call("read_attributes")
+        return [self._read(name) for name in names]
+
+    def write_attribute(self, name, value):
+        self._call("write_attribute")
+
+    def get_attribute_poll_period(self, name):
+        self._call("get_attribute_poll_period")
+        return 0
+
+    def polling_status(self):
+        self._call("polling_status")
+        return []
+
+    def command_list_query(self):
+        self._call("command_list_query")
+        return [Info(cmd_name=name, in_type=PyTango.CmdArgType.DevVoid,
+                     out_type=PyTango.CmdArgType.DevString)
+                for name in ("Init", "State", "Status")]
+
+    def command_query(self, name):
+        self._call("command_query")
+        return Info(cmd_name=name, in_type=PyTango.CmdArgType.DevVoid,
+                    out_type=PyTango.CmdArgType.DevString)
+
+    def command_inout(self, name, *args):
+        self._call("command_inout")
+        return "ok"
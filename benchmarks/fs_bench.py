@@ -0,0 +1,201 @@
+"""
+Measures TangoFS, without FUSE, against a fake control system.
+
+The filesystem operations that typical shell commands cause are made
+directly on a TangoFS instance:
+
+  ls     like "ls -lR devices": readdir of every directory, getattr
+         of every entry
+  grep   like "grep -r devices": ls, and also reading every file
+  cat    like "cat devices/*/*/*/attributes/*/value": finding all
+         attribute directories and reading the value files
+
+Each workload is run on a fresh filesystem ("cold") and then once more
+on the same one ("warm"). Reported are the operations per second, the
+50th/99th percentile latency of each kind of operation, and the number
+of calls that reached the (fake) backend.
+
+    $ python -m benchmarks.fs_bench --help
+"""
+
+from __future__ import print_function
+
+from collections import defaultdict
+import optparse
+import os
+import stat
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from fuse import FuseOSError
+
+from benchmarks.fakes import FakeTango, add_tree_options
+
+
+CHUNK = 128 * 1024  # FUSE read size
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Recorder(object):
+
+    """Wraps a TangoFS, timing each call of the filesystem operations
+    the workloads use."""
+
+    OPERATIONS = ("getattr", "readdir", "open", "read", "release")
+
+    def __init__(self, fs):
+        self.fs = fs
+        self.latencies = defaultdict(list)
+        self.errors = 0
+
+    def __getattr__(self, name):
+        if name not in self.OPERATIONS:
+            raise AttributeError(name)
+        operation = getattr(self.fs, name)
+        latencies = self.latencies[name]
+
+        def timed(*args):
+            start = time()
+            try:
+                return operation(*args)
+            finally:
+                latencies.append(time() - start)
+
+        return timed
+
+
+def is_dir(attrs):
+    return stat.S_ISDIR(attrs["st_mode"])
+
+
+def walk(fs, path):
+    """Yields (path, stat) of everything under path, the way "ls -lR"
+    finds it. Files that can't be stat'ed are skipped."""
+    for entry in fs.readdir(path, 0)[2:]:
+        name, attrs, _ = entry
+        child = path.rstrip("/") + "/" + name
+        if attrs is None:
+            try:
+                attrs = fs.getattr(child)
+            except FuseOSError:
+                fs.errors += 1
+                continue
+        yield child, attrs
+        if is_dir(attrs):
+            for item in walk(fs, child):
+                yield item
+
+
+def read_file(fs, path):
+    try:
+        fh = fs.open(path, os.O_RDONLY)
+    except FuseOSError:
+        fs.errors += 1
+        return
+    try:
+        offset = 0
+        while True:
+            data = fs.read(path, CHUNK, offset, fh)
+            if not data:
+                break
+            offset += len(data)
+    except FuseOSError:
+        fs.errors += 1
+    finally:
+        fs.release(path, fh)
+
+
+def ls(fs, root):
+    for _ in walk(fs, root):
+        pass
+
+
+def grep(fs, root):
+    for path, attrs in walk(fs, root):
+        if not is_dir(attrs):
+            read_file(fs, path)
+
+
+def cat(fs, root):
+    # expand the glob, one level at a time
+    paths = [root]
+    for _ in range(3):
+        paths = [path + "/" + entry[0] for path in paths
+                 for entry in fs.readdir(path, 0)[2:]]
+    for device in paths:
+        attributes = device + "/attributes"
+        try:
+            names = [entry[0] for entry in fs.readdir(attributes, 0)[2:]]
+        except (FuseOSError, KeyError):
+            fs.errors += 1  # e.g. device down
+            continue
+        for name in names:
+            value = attributes + "/" + name + "/value"
+            try:
+                fs.getattr(value)
+            except FuseOSError:
+                fs.errors += 1
+                continue
+            read_file(fs, value)
+
+
+WORKLOADS = {"ls": ls, "grep": grep, "cat": cat}
+
+
+def report(name, recorder, elapsed, calls):
+    ops = sum(len(l) for l in recorder.latencies.values())
+    print("%-10s %7d ops in %6.2f s, %8.0f ops/s, %d errors" % (
+        name, ops, elapsed, ops / elapsed if elapsed else 0,
+        recorder.errors))
+    for operation in Recorder.OPERATIONS:
+        latencies = recorder.latencies.get(operation)
+        if latencies:
+            print("  %-8s %7d   p50 %8.3f ms   p99 %8.3f ms" % (
+                operation, len(latencies),
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.99) * 1000))
+    print("  backend calls: %d" % sum(calls.values()))
+    for call, count in sorted(calls.items()):
+        print("    %-40s %6d" % (call, count))
+
+
+def run(tango, workload, root="/devices", **options):
+    fs = tango.mount(**options)
+    for run_name in ("cold", "warm"):
+        tango.calls.clear()
+        recorder = Recorder(fs)
+        start = time()
+        WORKLOADS[workload](recorder, root)
+        elapsed = time() - start
+        report("%s/%s" % (workload, run_name), recorder, elapsed,
+               tango.calls)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] [workload...]",
+                                   description=("Workloads: " +
+                                                ", ".join(sorted(WORKLOADS))))
+    add_tree_options(parser)
+    parser.add_option("-b", "--bulk-index", action="store_true",
+                      default=False)
+    parser.add_option("-l", "--lazy-size", action="store_true",
+                      default=False)
+    options, workloads = parser.parse_args()
+
+    tango = FakeTango.from_options(options)
+    print("%d devices, %d attributes and %d properties each" % (
+        len(tango.devices), len(tango.attributes), options.properties))
+    for workload in workloads or sorted(WORKLOADS):
+        run(tango, workload, bulk_index=options.bulk_index,
+            lazy_size=options.lazy_size, direct_io=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Load test of a mounted TangoFS, with a fake control system behind it.
+
+TangoFS is mounted through FUSE on a temporary directory, the way the
+tangofs command does it (multithreaded, direct_io). A number of
+simulated users then run shell commands on it concurrently, each
+picking one at random, over and over:
+
+  find   find one server domain
+  grep   grep -r through the properties of a device
+  tail   tail the value of a scalar or spectrum attribute
+  sed    sed -i on a property (rewriting it unchanged)
+
+When time is up, the filesystem is unmounted and the throughput and
+latency percentiles of each FUSE operation, and of each command, are
+reported. Needs FUSE, and permission to mount.
+
+    $ python -m benchmarks.load --users 8 --duration 30
+"""
+
+from __future__ import print_function
+
+from collections import defaultdict
+import optparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from threading import Lock, Thread
+from time import sleep, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from fuse import FUSE, FuseOSError
+
+from benchmarks.fakes import FakeTango, add_tree_options
+from benchmarks.fs_bench import percentile
+
+
+class TimedOperations(object):
+
+    """Stands in for a TangoFS towards FUSE, timing every operation,
+    and counting the ones that fail."""
+
+    def __init__(self, fs):
+        self.fs = fs
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = Lock()
+
+    def __getattr__(self, name):
+        # FUSE checks which operations exist
+        return getattr(self.fs, name)
+
+    def __call__(self, op, *args):
+        start = time()
+        try:
+            return self.fs(op, *args)
+        except FuseOSError:
+            with self._lock:
+                self.errors[op] += 1
+            raise
+        finally:
+            elapsed = time() - start
+            with self._lock:
+                self.latencies[op].append(elapsed)
+
+
+class User(Thread):
+
+    "Runs random shell commands on the mounted filesystem"
+
+    def __init__(self, n, mountpoint, tango, deadline):
+        Thread.__init__(self, name="user-%d" % n)
+        self.daemon = True
+        self.mountpoint = mountpoint
+        self.devices = sorted(tango.devices)
+        self.properties = sorted(next(iter(tango.properties.values())))
+        self.attributes = [name for name, (info, _) in
+                           sorted(tango.attributes.items())
+                           if name != "Image"]
+        self.deadline = deadline
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.random = random.Random(n)
+
+    def path(self, *parts):
+        return os.path.join(self.mountpoint, "devices", *parts)
+
+    def find(self):
+        domain = self.random.choice(self.devices).split("/")[0]
+        return ["find", self.path(domain)]
+
+    def grep(self):
+        device = self.random.choice(self.devices)
+        return ["grep", "-r", "value", self.path(*device.split("/")) +
+                "/properties"]
+
+    def tail(self):
+        device = self.random.choice(self.devices)
+        attribute = self.random.choice(self.attributes)
+        return ["tail", "-n", "5", self.path(*device.split("/")) +
+                "/attributes/%s/value" % attribute]
+
+    def sed(self):
+        device = self.random.choice(self.devices)
+        prop = self.random.choice(self.properties)
+        return ["sed", "-i", "s/value/value/", self.path(*device.split("/"))
+                + "/properties/" + prop]
+
+    COMMANDS = ("find", "grep", "tail", "sed")
+
+    def run(self):
+        with open(os.devnull, "w") as devnull:
+            while time() < self.deadline:
+                name = self.random.choice(self.COMMANDS)
+                command = getattr(self, name)()
+                start = time()
+                status = subprocess.call(command, stdout=devnull,
+                                         stderr=devnull)
+                self.latencies[name].append(time() - start)
+                if status:
+                    self.failures[name] += 1
+
+
+def print_stats(title, latencies, failures, elapsed):
+    print(title)
+    print("  %-10s %7s %10s %6s" % ("", "count", "rate", "failed"))
+    for name in sorted(latencies):
+        values = latencies[name]
+        print("  %-10s %7d %8.1f/s %6d   p50 %8.2f  p90 %8.2f  "
+              "p99 %8.2f  max %8.2f ms" % (
+                  name, len(values), len(values) / elapsed,
+                  failures.get(name, 0),
+                  percentile(values, 0.5) * 1000,
+                  percentile(values, 0.9) * 1000,
+                  percentile(values, 0.99) * 1000,
+                  max(values) * 1000))
+
+
+def unmount(mountpoint):
+    for command in (["fusermount", "-u", mountpoint], ["umount", mountpoint]):
+        try:
+            if subprocess.call(command) == 0:
+                return
+        except OSError:
+            pass  # no such command here
+    print("Could not unmount %s!" % mountpoint)
+
+
+def drive(mountpoint, tango, options, results):
+    "Wait for the mount, run the users, then unmount"
+    while not os.path.ismount(mountpoint):
+        sleep(0.1)
+    start = time()
+    deadline = start + options.duration
+    users = [User(n, mountpoint, tango, deadline)
+             for n in range(options.users)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    results["elapsed"] = time() - start
+    results["users"] = users
+    unmount(mountpoint)
+
+
+def main():
+    parser = optparse.OptionParser()
+    add_tree_options(parser)
+    parser.add_option("-u", "--users", type="int", default=4,
+                      help="number of concurrent users")
+    parser.add_option("-d", "--duration", type="float", default=10.0,
+                      metavar="SECONDS")
+    parser.add_option("-b", "--bulk-index", action="store_true",
+                      default=False)
+    parser.add_option("-l", "--lazy-size", action="store_true",
+                      default=False)
+    options, _ = parser.parse_args()
+
+    tango = FakeTango.from_options(options)
+    fs = tango.mount(bulk_index=options.bulk_index,
+                     lazy_size=options.lazy_size, direct_io=True)
+    operations = TimedOperations(fs)
+    mountpoint = tempfile.mkdtemp(prefix="tangofs-load-")
+    results = {}
+    driver = Thread(target=drive, args=(mountpoint, tango, options, results))
+    driver.daemon = True
+    driver.start()
+    try:
+        # FUSE wants to be in the main thread, and returns on unmount
+        FUSE(operations, mountpoint, foreground=True, nothreads=False,
+             direct_io=True)
+    finally:
+        driver.join(1)
+        os.rmdir(mountpoint)
+    if "users" not in results:
+        return  # interrupted
+
+    elapsed = results["elapsed"]
+    latencies = defaultdict(list)
+    failures = defaultdict(int)
+    for user in results["users"]:
+        for name, values in user.latencies.items():
+            latencies[name].extend(values)
+        for name, count in user.failures.items():
+            failures[name] += count
+    print("%d users for %.1f s, %d devices" % (options.users, elapsed,
+                                              len(tango.devices)))
+    print_stats("Commands", latencies, failures, elapsed)
+    print_stats("FUSE operations", operations.latencies, operations.errors,
+                elapsed)
+    print("Backend calls: %d" % sum(tango.calls.values()))
+
+
+if __name__ == "__main__":
+    main()
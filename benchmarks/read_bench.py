@@ -0,0 +1,102 @@
+"""
+Compares serving FUSE reads by slicing the file contents, as TangoFS
+used to do, with the memoryview based FileHandle.chunk().
+
+A big image (binary, kept in a bytearray) and a long spectrum (text,
+kept in a str) are read start to end in FUSE sized chunks. The old way
+slices a str copy of the contents, as they used to be kept. Throughput
+is measured, and the number of chunks and bytes copied by the reads.
+Where tracemalloc is available (Python 3) the peak memory allocated
+while reading is shown too.
+
+    $ python benchmarks/read_bench.py [image side in pixels]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tangofs"))
+from handles import FileHandle
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+CHUNK = 128 * 1024  # the usual FUSE read size
+
+
+def slice_read(contents, offset, size):
+    "The way reads were served before, contents being a str"
+    return contents[offset:offset+size]
+
+
+def read_all(read, contents):
+    offset = 0
+    while True:
+        chunk = read(offset, CHUNK)
+        if not chunk:
+            break
+        offset += len(chunk)
+    return offset
+
+
+def variants(contents):
+    "The ways of reading, each with the contents as it keeps them"
+    old = bytes(contents)
+    handle = FileHandle(1, "/bench", contents)
+    return [("slice", lambda o, s: slice_read(old, o, s), old),
+            ("memoryview", handle.chunk, contents)]
+
+
+def copied(read, contents):
+    "Number of chunks, and of bytes, copied by one full read"
+    counts = [0, 0]
+
+    def counting(offset, size):
+        chunk = read(offset, size)
+        if chunk and chunk is not contents:
+            counts[0] += 1
+            counts[1] += len(chunk)
+        return chunk
+    read_all(counting, contents)
+    return counts
+
+
+def allocated(read, contents):
+    "Peak memory allocated during one full read, in bytes"
+    tracemalloc.start()
+    read_all(read, contents)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(side=2048, repeat=5):
+    cases = [
+        ("image %dx%d uint16" % (side, side), bytearray(side * side * 2)),
+        ("spectrum %d values" % (side * side // 4),
+         "".join("%r\n" % (i * 0.5) for i in range(side * side // 4))
+         .encode("ascii")),
+    ]
+    for name, contents in cases:
+        size = len(contents) / 1024.0 / 1024.0
+        print("%s, %.1f MiB in %d kiB chunks" % (name, size, CHUNK // 1024))
+        for label, read, kept in variants(contents):
+            best = min(timeit.repeat(lambda: read_all(read, kept),
+                                     number=1, repeat=repeat))
+            line = "  %-12s %8.1f MiB/s" % (label, size / best)
+            line += "  %5d chunks, %8.1f kiB copied" % tuple(
+                n / d for n, d in zip(copied(read, kept), (1, 1024.0)))
+            if tracemalloc:
+                line += "  %8.1f kiB allocated" % (
+                    allocated(read, kept) / 1024.0)
+            print(line)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
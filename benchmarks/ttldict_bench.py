@@ -0,0 +1,125 @@
+"""
+Compares the heap based TTLDict with the previous implementation,
+which checked every key for expiry on each len() and iteration.
+
+    $ python benchmarks/ttldict_bench.py [number of keys]
+"""
+
+from collections import MutableMapping
+import os
+import sys
+from threading import RLock
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tangofs"))
+from ttldict import TTLDict
+
+
+class LegacyTTLDict(MutableMapping):
+
+    "The TTLDict as it was before version 0.1.0, for comparison"
+
+    def __init__(self, default_ttl, *args, **kwargs):
+        self._default_ttl = default_ttl
+        self._values = {}
+        self._lock = RLock()
+        self.update(*args, **kwargs)
+
+    def is_expired(self, key, now=None, remove=False):
+        with self._lock:
+            if now is None:
+                now = time.time()
+            expire, _value = self._values[key]
+            if expire is None:
+                return False
+            expired = expire < now
+            if expired and remove:
+                self.__delitem__(key)
+            return expired
+
+    def __len__(self):
+        with self._lock:
+            for key in self._values.keys():
+                self.is_expired(key, remove=True)
+            return len(self._values)
+
+    def __iter__(self):
+        with self._lock:
+            for key in self._values.keys():
+                if not self.is_expired(key, remove=True):
+                    yield key
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if self._default_ttl is None:
+                expire = None
+            else:
+                expire = time.time() + self._default_ttl
+            self._values[key] = (expire, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._values[key]
+
+    def __getitem__(self, key):
+        with self._lock:
+            self.is_expired(key, remove=True)
+            return self._values[key][1]
+
+
+def filled(cls, n, ttl=60):
+    d = cls(ttl)
+    for i in xrange(n):
+        d["key%d" % i] = i
+    return d
+
+
+def bench_len(cls, n):
+    d = filled(cls, n)
+    return lambda: len(d)
+
+
+def bench_iter(cls, n):
+    d = filled(cls, n)
+    return lambda: list(d)
+
+
+def bench_getitem(cls, n):
+    d = filled(cls, n)
+    keys = ["key%d" % i for i in xrange(0, n, max(1, n // 1000))]
+
+    def get():
+        for key in keys:
+            d[key]
+    return get
+
+
+def bench_expiry(cls, n):
+    "Fill with keys that expire at once, then check the length"
+    def expire():
+        d = filled(cls, n, ttl=0)
+        time.sleep(0.001)
+        len(d)
+    return expire
+
+
+BENCHMARKS = [("len()", bench_len), ("iterate", bench_iter),
+              ("1000 x getitem", bench_getitem), ("fill+expire", bench_expiry)]
+
+
+def main(n=10000, repeat=5):
+    print "%d keys, best of %d runs, in ms" % (n, repeat)
+    print "%-16s %12s %12s %8s" % ("", "legacy", "heap", "speedup")
+    for name, bench in BENCHMARKS:
+        times = []
+        for cls in (LegacyTTLDict, TTLDict):
+            func = bench(cls, n)
+            times.append(min(timeit.repeat(func, number=1, repeat=repeat)))
+        legacy, heap = times
+        print "%-16s %12.3f %12.3f %7.1fx" % (name, legacy * 1000, heap * 1000,
+                                              legacy / heap)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
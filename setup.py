@@ -9,7 +9,7 @@ setup(name='TangoFS',
       author='Johan Forsberg',
       author_email='johan.forsberg@gmail.com',
       py_modules=['tangofs'],
-      install_requires=["PyTango", "fusepy", "dateutils"],
+      install_requires=["PyTango", "fusepy", "dateutils", "numpy"],
       entry_points="""
       [console_scripts]
       tangofs=tangofs:main
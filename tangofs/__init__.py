@@ -4,6 +4,7 @@ import optparse
 from fuse import FUSE
 
 from tangofs import TangoFS
+import tracing
 
 
 def main():
@@ -13,11 +14,54 @@ def main():
                       action="store_true", default=False)
     parser.add_option("-f", "--foreground", help="Don't daemonize",
                       action="store_true", default=False)
+    parser.add_option("-b", "--bulk-index",
+                      help="Load all device names in a single DB query",
+                      action="store_true", default=False)
+    parser.add_option("-e", "--events", dest="event_timeout", type="float",
+                      metavar="SECONDS", default=None,
+                      help=("Serve repeatedly read attribute values from "
+                            "Tango events, unsubscribing after SECONDS idle"))
+    parser.add_option("-w", "--batch-window", type="float", metavar="SECONDS",
+                      default=None,
+                      help=("Let attribute reads wait up to SECONDS for "
+                            "others on the same device, to read them "
+                            "together (default 0, concurrent reads are "
+                            "batched anyway)"))
+    parser.add_option("-l", "--lazy-size",
+                      help=("Don't read attribute values on stat, only when "
+                            "the files are opened"),
+                      action="store_true", default=False)
+    parser.add_option("-z", "--png-level", type="int", metavar="LEVEL",
+                      default=None,
+                      help=("Compression level (0-9) for images served "
+                            "as PNG; low is fast, high is small"))
+    parser.add_option("-t", "--trace", metavar="FILE", default=None,
+                      help=("Trace operations and backend calls, and save "
+                            "them to FILE (Chrome trace format) on unmount"))
+    parser.add_option("--trace-sample", type="float", metavar="FRACTION",
+                      default=tracing.SAMPLE_RATE,
+                      help="Fraction of operations to trace (default 1)")
     options, arguments = parser.parse_args()
+    if options.png_level is not None and not 0 <= options.png_level <= 9:
+        parser.error("--png-level must be between 0 and 9")
 
     if options.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
         logging.basicConfig()
 
-    FUSE(TangoFS(), arguments[0], foreground=options.foreground,
-         nothreads=False, direct_io=True)
+    if options.trace:
+        tracer = tracing.enable(options.trace_sample)
+
+    direct_io = True
+    fs = TangoFS(bulk_index=options.bulk_index,
+                 event_timeout=options.event_timeout,
+                 lazy_size=options.lazy_size, direct_io=direct_io,
+                 png_level=options.png_level,
+                 batch_window=options.batch_window)
+    try:
+        FUSE(fs, arguments[0], foreground=options.foreground,
+             nothreads=False, direct_io=direct_io)
+    finally:
+        if options.trace:
+            with open(options.trace, "w") as f:
+                tracer.dump(f)
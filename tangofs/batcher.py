@@ -0,0 +1,107 @@
+"""
+Coalescing of concurrent attribute reads on the same device.
+
+When several FUSE threads read attributes of the same device at about
+the same time (e.g. "cat attributes/*/value" or a parallel grep) it's
+much cheaper to do one read_attributes call than one read_attribute
+call per attribute.
+"""
+
+from threading import Condition, Event
+from time import sleep
+
+import PyTango
+
+
+WINDOW = 0.0  # seconds to wait for more reads to join a batch
+
+
+class Batch(object):
+
+    "A set of attribute names to be read together"
+
+    def __init__(self):
+        self.names = []
+        self.readings = {}
+        self.done = Event()
+
+    def __contains__(self, attrname):
+        return attrname.lower() in self.readings
+
+    def add(self, attrname):
+        if attrname not in self:
+            self.readings[attrname.lower()] = None
+            self.names.append(attrname)
+
+    def run(self, proxy):
+        try:
+            for reading in proxy.read_attributes(self.names):
+                self.readings[reading.name.lower()] = reading
+        except PyTango.DevFailed:
+            pass  # nothing was read, see get()
+        finally:
+            self.done.set()
+
+    def get(self, attrname):
+        """Wait for the batch, and return the reading of the attribute,
+        or None if it wasn't read (e.g. the whole batch failed because
+        of one bad attribute)"""
+        self.done.wait()
+        return self.readings.get(attrname.lower())
+
+
+class ReadBatcher(object):
+
+    """Batches reads on one device proxy. A read is sent right away if
+    no other read is in flight on the device. Otherwise it's queued,
+    and all reads queued up while waiting are sent together in one
+    call, as soon as the one in flight returns. A read of an attribute
+    that is already in flight just waits for that. Each caller gets
+    its own reading back. If the batch fails, each attribute in it is
+    read on its own, so that one bad attribute doesn't fail the others.
+
+    If a window is given, reads also wait that long before being sent,
+    for others to join them. That makes bigger batches, but costs every
+    read the window in latency."""
+
+    def __init__(self, proxy, window=WINDOW):
+        self.proxy = proxy
+        self.window = window
+        self._running = None  # the batch being read
+        self._queued = None  # the batch to read next
+        self._cond = Condition()
+
+    def read(self, attrname):
+        with self._cond:
+            if self._running is not None and attrname in self._running:
+                batch, leader = self._running, False
+            else:
+                batch = self._queued
+                leader = batch is None
+                if leader:
+                    batch = self._queued = Batch()
+                batch.add(attrname)
+        if leader:
+            self._run(batch)
+        reading = batch.get(attrname)
+        if reading is None or reading.has_failed:
+            # read it separately, to get the reading or the proper error
+            # for this attribute, not one of the others in the batch
+            return self.proxy.read_attribute(attrname)
+        return reading
+
+    def _run(self, batch):
+        if self.window:
+            sleep(self.window)
+        with self._cond:
+            # reads arriving meanwhile keep joining the queued batch
+            while self._running is not None:
+                self._cond.wait()
+            self._queued = None  # later reads start a new batch
+            self._running = batch
+        try:
+            batch.run(self.proxy)
+        finally:
+            with self._cond:
+                self._running = None
+                self._cond.notify_all()
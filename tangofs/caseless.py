@@ -1,7 +1,9 @@
-"""A caseless dictionary implementation."""
+"""Caseless dictionary implementations."""
 
 from collections import MutableMapping
 
+from ttldict import TTLDict
+
 
 class CaselessDictionary(MutableMapping):
 
@@ -94,3 +96,28 @@ class CaselessStr(CaselessString, str):
 
 class CaselessUnicode(CaselessString, unicode):
     pass
+
+
+class CaselessTTLDict(TTLDict):
+
+    """
+    A TTLDict which ignores but preserves the case of string keys, like
+    CaselessDictionary. Keys are lowercased once per operation and stored
+    next to the original, so lookups don't need any wrapper objects.
+    The TTL may be None, meaning that keys never expire, and max_size
+    limits the number of keys (least recently used are evicted).
+
+        >>> cdict = CaselessTTLDict(None)
+        >>> cdict['aBc'] = 1
+        >>> cdict['ABC']
+        1
+        >>> cdict['abc'] = 2
+        >>> list(cdict)
+        ['aBc']
+    """
+
+    @staticmethod
+    def _normalize(key):
+        if isinstance(key, basestring):
+            return key.lower()
+        return key
@@ -0,0 +1,152 @@
+"""
+An optional cache of attribute values, kept up to date by Tango events.
+
+Attributes that are read repeatedly (e.g. by a script polling a value
+file) get subscribed to change events, or periodic events as a
+fallback, and are then served from memory instead of being read from
+the device each time. Subscriptions that have not been used for a
+while are dropped again.
+"""
+
+import logging
+from threading import RLock, Thread
+from time import sleep, time
+
+import PyTango
+
+from ttldict import TTLDict
+
+
+# The event types to try, in order of preference
+EVENT_TYPES = (PyTango.EventType.CHANGE_EVENT,
+               PyTango.EventType.PERIODIC_EVENT)
+
+IDLE_TIMEOUT = 60.0  # seconds
+
+_cache = None
+
+
+def enable(idle_timeout=IDLE_TIMEOUT):
+    "Turn on the event cache for the whole process"
+    global _cache
+    _cache = AttributeEventCache(idle_timeout)
+    return _cache
+
+
+def get_cache():
+    "Return the event cache, or None if it's not enabled"
+    return _cache
+
+
+class Subscription(object):
+
+    "An event subscription to one attribute, holding the latest reading"
+
+    def __init__(self, proxy, attrname):
+        self.proxy = proxy
+        self.attrname = attrname
+        self.event_id = None
+        self.reading = None
+        self.last_used = time()
+
+    def subscribe(self):
+        for event_type in EVENT_TYPES:
+            try:
+                self.event_id = self.proxy.subscribe_event(
+                    self.attrname, event_type, self.push_event)
+                return True
+            except PyTango.DevFailed as e:
+                logging.debug("cannot subscribe to %s events for %s: %s",
+                              event_type, self.attrname, e)
+        return False
+
+    def unsubscribe(self):
+        if self.event_id is None:
+            return
+        try:
+            self.proxy.unsubscribe_event(self.event_id)
+        except PyTango.DevFailed as e:
+            logging.debug("cannot unsubscribe from %s: %s", self.attrname, e)
+        self.event_id = None
+        self.reading = None
+
+    def push_event(self, event):
+        "Event callback, called by Tango in its own thread"
+        if event.err:
+            # don't serve anything until we get a proper value again
+            self.reading = None
+        else:
+            self.reading = event.attr_value
+
+
+class AttributeEventCache(object):
+
+    """Keeps the latest readings of "watched" attributes. An attribute
+    counts as watched when it is read a second time within the idle
+    timeout; one-off reads (e.g. a single "cat") never subscribe.
+    Subscriptions idle for longer than the timeout are removed by a
+    background thread, which itself stops when there are none left."""
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._subscriptions = {}  # (device, attribute) -> Subscription
+        self._candidates = TTLDict(idle_timeout)  # recently read once
+        self._failed = TTLDict(idle_timeout)  # don't retry these for a while
+        self._lock = RLock()
+        self._reaper = None
+
+    def read(self, proxy, devicename, attrname):
+        """Return the latest reading of the attribute, or None if there
+        is none available, in which case the caller should read it."""
+        if proxy is None:
+            return None  # nothing to subscribe with
+        key = (devicename.lower(), attrname.lower())
+        with self._lock:
+            sub = self._subscriptions.get(key)
+            if sub is not None:
+                sub.last_used = time()
+                return sub.reading
+            if key in self._failed:
+                return None
+            if key not in self._candidates:
+                self._candidates[key] = True
+                return None
+            del self._candidates[key]
+            sub = self._subscriptions[key] = Subscription(proxy, attrname)
+            self._start_reaper()
+        # Tango may call the callback from the subscribing thread,
+        # so subscribe without holding the lock.
+        if not sub.subscribe():
+            with self._lock:
+                self._subscriptions.pop(key, None)
+                self._failed[key] = True
+            return None
+        return sub.reading
+
+    def __len__(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def _start_reaper(self):
+        if self._reaper is None:
+            self._reaper = Thread(target=self._reap, name="event-reaper")
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            sleep(self.idle_timeout / 2.0)
+            now = time()
+            with self._lock:
+                idle = [key for key, sub in self._subscriptions.items()
+                        if now - sub.last_used > self.idle_timeout]
+                stale = [self._subscriptions.pop(key) for key in idle]
+                done = not self._subscriptions
+                if done:
+                    self._reaper = None
+            for sub in stale:
+                logging.debug("dropping idle subscription to %s",
+                              sub.attrname)
+                sub.unsubscribe()
+            if done:
+                return
@@ -0,0 +1,143 @@
+"""
+Fast rendering of array values as text or binary.
+
+Instead of converting each element to a string separately and joining
+them, integers are written digit by digit, for all elements at once,
+into a byte buffer. Other values are converted by numpy to an array of
+strings in one go, which is then joined into lines. Values with a
+format are formatted a block of lines at a time with one template.
+
+Binary representations are made by copying the array data straight
+into the output buffer, after a header.
+"""
+
+import numpy as np
+import PyTango
+
+
+BLOCK = 4096  # number of elements to format with one template
+
+
+# numpy types for the numeric Tango types
+DTYPES = {
+    PyTango.CmdArgType.DevBoolean: np.bool_,
+    PyTango.CmdArgType.DevUChar: np.uint8,
+    PyTango.CmdArgType.DevShort: np.int16,
+    PyTango.CmdArgType.DevUShort: np.uint16,
+    PyTango.CmdArgType.DevLong: np.int32,
+    PyTango.CmdArgType.DevULong: np.uint32,
+    PyTango.CmdArgType.DevLong64: np.int64,
+    PyTango.CmdArgType.DevULong64: np.uint64,
+    PyTango.CmdArgType.DevFloat: np.float32,
+    PyTango.CmdArgType.DevDouble: np.float64,
+}
+
+
+def as_array(value, info=None):
+    """The value as a contiguous numpy array, of the attribute's type
+    if it's known. Doesn't copy if the value already is one."""
+    dtype = DTYPES.get(info.data_type) if info else None
+    array = np.asarray(value, dtype=dtype)
+    if not array.flags.c_contiguous:
+        array = np.ascontiguousarray(array)  # keeps scalars 0-d
+    return array
+
+
+def max_shape(info):
+    "The shape of the largest value the attribute can have"
+    if info.data_format == PyTango.AttrDataFormat.SPECTRUM:
+        return (info.max_dim_x,)
+    if info.data_format == PyTango.AttrDataFormat.IMAGE:
+        return (info.max_dim_y, info.max_dim_x)
+    return ()
+
+
+def join_buffer(header, array):
+    "The header followed by the raw data of the array, copied only once"
+    out = bytearray(len(header) + array.nbytes)
+    out[:len(header)] = header
+    data = np.frombuffer(out, dtype=np.uint8, offset=len(header))
+    data[:] = array.reshape(-1).view(np.uint8)
+    return out
+
+
+def element_format(fmt, array):
+    """Returns the attribute's format if it's a numeric one that works
+    with the data, otherwise None. Booleans are never formatted as
+    numbers."""
+    if array.dtype.kind in "iuf" and fmt and "%" in fmt:
+        try:
+            fmt % array.flat[0].item()
+            return fmt
+        except (TypeError, ValueError):
+            pass  # e.g. "Not specified"
+
+
+def format_integers(array):
+    """Write a 2D integer array as decimal text, digit by digit for all
+    elements at once, into a byte buffer with a fixed width slot per
+    element. The unused (zero) bytes are dropped at the end."""
+    if array.dtype.kind == "u":
+        magnitude = array.astype(np.uint64)
+    else:
+        # the absolute value of the smallest int64 only fits unsigned
+        magnitude = np.abs(array.astype(np.int64)).astype(np.uint64)
+    largest = magnitude.max()
+    width = len(str(largest))
+    if largest < 2 ** 32:
+        magnitude = magnitude.astype(np.uint32)  # much faster to divide
+    # a slot is a sign, the digits and a separator
+    out = np.zeros(array.shape + (width + 2,), dtype=np.uint8)
+    digits = np.ones(array.shape, dtype=np.uint8)
+    for position in range(width, 0, -1):
+        magnitude, digit = np.divmod(magnitude, 10)
+        out[..., position] = digit
+        out[..., position] += ord("0")
+        digits += magnitude > 0
+    leading = np.arange(width + 2) < (width + 1 - digits)[..., np.newaxis]
+    out[leading] = 0  # zeros in front of the number
+    negative = np.nonzero(array < 0)
+    out[negative + (width - digits[negative],)] = ord("-")
+    out[:, :, -1] = ord(" ")
+    out[:, -1, -1] = ord("\n")
+    return out[out != 0].tostring()
+
+
+def format_rows(array, fmt):
+    """Format a 2D array with a template for a block of rows at a time,
+    like np.savetxt does for each row."""
+    rows, columns = array.shape
+    line = " ".join([fmt] * columns) + "\n"
+    step = max(BLOCK // columns, 1)
+    parts = []
+    for start in range(0, rows, step):
+        block = array[start:start + step]
+        parts.append((line * len(block)) % tuple(block.ravel().tolist()))
+    return "".join(parts)
+
+
+def format_array(value, fmt=None):
+    """Format a 1D (spectrum) or 2D (image) array as text. Spectra get
+    one element per line, images one row per line with the elements
+    separated by spaces."""
+    array = np.asarray(value)
+    if array.size == 0:
+        return "\n"
+    if array.ndim < 2:
+        array = array.reshape(-1, 1)
+    elif array.ndim > 2:
+        array = array.reshape(array.shape[0], -1)
+    fmt = element_format(fmt, array)
+    if fmt:
+        return format_rows(array, fmt)
+    if array.dtype.kind in "iu":
+        return format_integers(array)
+    if array.dtype.kind == "b":
+        strings = np.where(array, "True", "False")
+    else:
+        # converted by numpy in one go, floats get their shortest
+        # exact representation
+        strings = array.astype(str)
+    if array.shape[1] == 1:
+        return "\n".join(strings.ravel().tolist()) + "\n"
+    return "\n".join(" ".join(row) for row in strings.tolist()) + "\n"
@@ -0,0 +1,147 @@
+"""
+Open file handles, and a bounded cache of file contents.
+
+Each open file gets its own handle, holding a snapshot of the file
+contents for as long as it's open. That way concurrent readers of the
+same file don't overwrite each other's data, and everything goes away
+when the file is released.
+
+Contents that were produced without a file being opened (e.g. to find
+out the size of an attribute value on stat) are kept in a ContentCache
+with a memory budget, so that an open following right after the stat
+can pick them up, while a long "find" doesn't make memory grow.
+"""
+
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
+from time import time
+
+
+MEMORY_BUDGET = 64 * 1024 * 1024  # bytes of cached contents to keep
+MAX_AGE = 5.0  # seconds before cached contents are considered stale
+
+
+class FileHandle(object):
+
+    """An open file, with its own copy of the contents. Reads are
+    served through a memoryview of the contents, so that reading a big
+    file in chunks only copies each chunk once."""
+
+    def __init__(self, fh, path, contents=None):
+        self.fh = fh
+        self.path = path
+        self.contents = contents
+
+    @property
+    def contents(self):
+        return self._contents
+
+    @contents.setter
+    def contents(self, contents):
+        if contents is not None and not isinstance(contents,
+                                                   (bytes, bytearray)):
+            contents = contents.encode("utf-8")
+        self._contents = contents
+        self._view = None
+
+    def chunk(self, offset, size):
+        "Returns (as bytes) the part of the contents asked for by a read"
+        contents = self._contents
+        if (offset == 0 and size >= len(contents)
+                and isinstance(contents, bytes)):
+            return contents  # the whole thing, no copy needed
+        if self._view is None:
+            self._view = memoryview(contents)
+        return self._view[offset:offset+size].tobytes()
+
+
+class FileHandles(object):
+
+    "Keeps track of open files by file handle number"
+
+    def __init__(self):
+        self._handles = {}
+        self._numbers = count(1)
+        self._lock = Lock()
+
+    def open(self, path, contents=None):
+        with self._lock:
+            fh = next(self._numbers)
+            self._handles[fh] = FileHandle(fh, path, contents)
+            return fh
+
+    def __getitem__(self, fh):
+        with self._lock:
+            return self._handles[fh]
+
+    def release(self, fh):
+        with self._lock:
+            self._handles.pop(fh, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._handles)
+
+
+class ContentCache(object):
+
+    """File contents by path, least recently stored first out when
+    the total size goes over the budget. Contents older than max_age
+    (if given) are never returned.
+
+    Contents may be stored with a tag, e.g. the time of the reading
+    they were made from, and are then only returned for the same tag."""
+
+    def __init__(self, budget=MEMORY_BUDGET, max_age=MAX_AGE):
+        self.budget = budget
+        self.max_age = max_age
+        self.size = 0
+        # path -> (timestamp, contents, tag)
+        self._contents = OrderedDict()
+        self._lock = Lock()
+
+    def __setitem__(self, path, contents):
+        self.put(path, contents)
+
+    def put(self, path, contents, tag=None):
+        with self._lock:
+            self._remove(path)
+            self._contents[path] = (time(), contents, tag)
+            self.size += len(contents)
+            while self.size > self.budget and self._contents:
+                self._remove(next(iter(self._contents)))
+
+    def get(self, path, tag=None):
+        "Return the contents of the path if fresh and stored with the tag"
+        with self._lock:
+            timestamp, contents, stored_tag = (self._contents.get(path)
+                                               or (None, None, None))
+            if self._fresh(timestamp) and stored_tag == tag:
+                return contents
+
+    def pop(self, path):
+        "Take the contents of the path out of the cache, if still fresh"
+        with self._lock:
+            timestamp, contents, _ = self._remove(path) or (None, None, None)
+            if self._fresh(timestamp):
+                return contents
+
+    def invalidate(self, path):
+        with self._lock:
+            self._remove(path)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._contents), "bytes": self.size}
+
+    def _fresh(self, timestamp):
+        if timestamp is None:
+            return False
+        return self.max_age is None or time() - timestamp <= self.max_age
+
+    def _remove(self, path):
+        item = self._contents.pop(path, None)
+        if item is not None:
+            self.size -= len(item[1])
+        return item
@@ -0,0 +1,168 @@
+"""
+Keeps track of which devices are reachable.
+
+Pinging a device that is down blocks for the full client timeout,
+which makes e.g. "ls devices/*/*/*" crawl when there are dead devices
+around. Instead, ping results are cached (with separate TTLs for up
+and down devices) and devices that are down fail fast straight from
+the cache. Meanwhile, a few background threads keep re-probing the
+down devices, so they come back once they are up again. The threads
+stop when there are no down devices left.
+
+Whatever depends on a device being up (e.g. cached parts of the tree)
+can register a listener, to hear when a device goes down or comes back.
+"""
+
+import logging
+from Queue import Queue
+from threading import RLock, Thread
+from time import sleep, time
+
+import PyTango
+
+from ttldict import TTLDict
+
+
+UP_TTL = 10.0  # seconds before re-pinging a device that was up
+DOWN_TTL = 30.0  # seconds between background probes of down devices
+FORGET_AFTER = 10  # stop probing down devices nobody asked about in
+                   # this many DOWN_TTL periods
+WORKERS = 4  # number of background probing threads
+
+
+class DeviceHealth(object):
+
+    """A cache of device ping results, acting as a circuit breaker.
+    Devices seen up are trusted for up_ttl seconds. Devices seen down
+    are reported as down without pinging, until one of the background
+    probes finds them up again."""
+
+    def __init__(self, proxies, up_ttl=UP_TTL, down_ttl=DOWN_TTL,
+                 workers=WORKERS):
+        self._proxies = proxies
+        self.down_ttl = down_ttl
+        self._up = TTLDict(up_ttl)
+        self._down = {}  # name -> [last probed, last asked about]
+        self._probing = set()
+        self._queue = Queue()
+        self._lock = RLock()
+        self._nworkers = workers
+        self._workers = []
+        self._watcher = None
+        self._listeners = []
+        self.pings = 0
+        self.fast_fails = 0
+
+    def add_listener(self, listener):
+        """Have listener(devicename) called whenever a device goes down
+        or comes back up, or when it's no longer known which it is"""
+        self._listeners.append(listener)
+
+    def _changed(self, name):
+        for listener in self._listeners:
+            try:
+                listener(name)
+            except Exception as e:
+                logging.warning("health listener failed on %s: %s", name, e)
+
+    def is_up(self, devicename):
+        name = devicename.lower()
+        with self._lock:
+            if name in self._up:
+                return True
+            down = self._down.get(name)
+            if down is not None:
+                down[1] = time()
+                self.fast_fails += 1
+                return False
+        return self.probe(name)
+
+    def probe(self, devicename):
+        "Ping the device right now and update its status"
+        name = devicename.lower()
+        with self._lock:
+            self.pings += 1
+        try:
+            self._proxies.get(name).ping()
+        except PyTango.DevFailed as e:
+            logging.debug("cannot communicate with device %s: %s", name, e)
+            self._proxies.discard(name)
+            if self._mark_down(name):
+                self._changed(name)
+            return False
+        with self._lock:
+            came_up = self._down.pop(name, None) is not None
+            self._up[name] = True
+        if came_up:
+            self._changed(name)
+        return True
+
+    def _mark_down(self, name):
+        "Returns whether the device just went down"
+        now = time()
+        with self._lock:
+            self._up.pop(name, None)
+            went_down = name not in self._down
+            if went_down:
+                self._down[name] = [now, now]
+            else:
+                self._down[name][0] = now
+            self._start_threads()
+        return went_down
+
+    def _start_threads(self):
+        if not self._workers:
+            for i in range(self._nworkers):
+                worker = Thread(target=self._work, name="health-%d" % i)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        if self._watcher is None:
+            self._watcher = Thread(target=self._watch, name="health-watcher")
+            self._watcher.daemon = True
+            self._watcher.start()
+
+    def _watch(self):
+        "Queue up probes of down devices, as they become due"
+        while True:
+            sleep(self.down_ttl / 2.0)
+            now = time()
+            forgotten = []
+            with self._lock:
+                for name, (probed, asked) in self._down.items():
+                    if now - asked > FORGET_AFTER * self.down_ttl:
+                        # nobody cares about this device, next time
+                        # it's needed it will be pinged again
+                        del self._down[name]
+                        forgotten.append(name)
+                    elif (now - probed > self.down_ttl
+                          and name not in self._probing):
+                        self._probing.add(name)
+                        self._queue.put(name)
+                done = not self._down
+                if done:
+                    # nothing left to probe, stop the workers too
+                    for worker in self._workers:
+                        self._queue.put(None)
+                    self._workers = []
+                    self._watcher = None
+            for name in forgotten:
+                self._changed(name)
+            if done:
+                return
+
+    def _work(self):
+        while True:
+            name = self._queue.get()
+            if name is None:
+                return  # told to stop
+            try:
+                self.probe(name)
+            finally:
+                with self._lock:
+                    self._probing.discard(name)
+
+    def stats(self):
+        with self._lock:
+            return {"up": len(self._up), "down": len(self._down),
+                    "pings": self.pings, "fast_fails": self.fast_fails}
@@ -0,0 +1,94 @@
+"""
+Encoding of image attribute values as picture files.
+
+This used to be done with scipy, which is a big dependency for this
+and always used its default (slow) compression level. PNG files are
+written here directly with zlib, at a configurable level. There's also
+PGM/PPM, which is not compressed at all and therefore very fast.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+
+PNG_LEVEL = 1  # zlib compression level, 0 (none) to 9 (best, slowest)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+GRAY, RGB = 0, 2  # PNG color types
+
+
+def to_uint8(array):
+    """Scale the array to the full 0-255 range, unless it's already
+    8 bit data (this is the same as scipy.misc.toimage does)"""
+    if array.dtype == np.uint8:
+        return array
+    array = array.astype(np.float32)
+    low, high = array.min(), array.max()
+    scale = 255.0 / (high - low) if high > low else 0.0
+    return ((array - low) * scale + 0.4999).astype(np.uint8)
+
+
+def _rows(array):
+    "Returns the image as 2D array of rows of bytes, and its color type"
+    if array.ndim == 2:
+        return array, GRAY
+    if array.ndim == 3 and array.shape[2] == 3:
+        return array.reshape(array.shape[0], -1), RGB
+    raise ValueError("Can't make an image of shape %r" % (array.shape,))
+
+
+def _chunk(tag, data):
+    crc = zlib.crc32(tag + data) & 0xffffffff
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+
+def encode_png(value, level=None):
+    "Encode a 2D (grayscale) or 3D (RGB) array as a PNG image"
+    array = to_uint8(np.asarray(value))
+    rows, color = _rows(array)
+    height, width = array.shape[:2]
+    # each row starts with a filter type byte, 0 means no filtering
+    data = np.zeros((height, rows.shape[1] + 1), dtype=np.uint8)
+    data[:, 1:] = rows
+    if level is None:
+        level = PNG_LEVEL
+    header = struct.pack(">IIBBBBB", width, height, 8, color, 0, 0, 0)
+    return b"".join([PNG_SIGNATURE,
+                     _chunk(b"IHDR", header),
+                     _chunk(b"IDAT", zlib.compress(data.tostring(), level)),
+                     _chunk(b"IEND", b"")])
+
+
+def png_size_bound(width, height):
+    """The largest size a grayscale PNG image of the given size can
+    have, i.e. if the data doesn't compress at all"""
+    raw = height * (width + 1)
+    # see compressBound() in zlib
+    compressed = raw + (raw >> 12) + (raw >> 14) + (raw >> 25) + 13
+    return len(PNG_SIGNATURE) + 3 * 12 + 13 + compressed
+
+
+def pnm_size(width, height, depth=1):
+    "The size of a PGM image of the given size, with bytes per pixel"
+    maxval = 65535 if depth == 2 else 255
+    header = "P5\n%d %d\n%d\n" % (width, height, maxval)
+    return len(header) + width * height * depth
+
+
+def encode_pnm(value):
+    """Encode a 2D array as a PGM image, or a 3D (RGB) one as PPM.
+    16 bit data is kept as it is, anything else is scaled to 8 bits."""
+    array = np.asarray(value)
+    if array.dtype == np.uint16:
+        maxval = 65535
+        array = array.astype(">u2")  # PNM wants big endian
+    else:
+        maxval = 255
+        array = to_uint8(array)
+    rows, color = _rows(array)
+    height, width = array.shape[:2]
+    magic = "P6" if color == RGB else "P5"
+    header = "%s\n%d %d\n%d\n" % (magic, width, height, maxval)
+    return header + array.tostring()
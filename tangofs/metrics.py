@@ -0,0 +1,138 @@
+"""
+Counters of what the filesystem does to the backend.
+
+Every call made through an ObjectWrapper (i.e. to the Tango database
+or a device proxy) is counted per method, along with errors and a
+histogram of how long the calls took. The tree dicts count how often
+their children were found already built, and how often they had to
+load things from the backend.
+
+All of it can be read from the "/.stats" (text) and "/.stats.json"
+files at the root of the filesystem.
+"""
+
+from bisect import bisect_left
+from collections import Counter
+import json
+from thread import get_ident
+from threading import Lock, local
+
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0)
+
+
+class CallStats(object):
+
+    "Number of calls to one method, errors and latency histogram"
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)  # the last is overflow
+
+    def add(self, elapsed, failed=False):
+        self.count += 1
+        self.errors += failed
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.histogram[bisect_left(BUCKETS, elapsed)] += 1
+
+    def to_dict(self):
+        return {"count": self.count, "errors": self.errors,
+                "total": self.total, "max": self.max,
+                "histogram": dict(zip(bucket_labels(), self.histogram))}
+
+
+def bucket_labels():
+    labels = ["<=%gms" % (bound * 1000) for bound in BUCKETS]
+    return labels + [">%gms" % (BUCKETS[-1] * 1000)]
+
+
+class Metrics(object):
+
+    "Backend call and cache statistics for the whole process"
+
+    def __init__(self):
+        self._calls = {}  # e.g. "Database.get_device_name" -> CallStats
+        # (kind, event) -> count, for each thread by thread id. A thread
+        # that gets the id of one that is gone carries on its counts.
+        self._counters = {}
+        self._local = local()
+        self._lock = Lock()
+
+    def add_call(self, name, elapsed, failed=False):
+        with self._lock:
+            stats = self._calls.get(name)
+            if stats is None:
+                stats = self._calls[name] = CallStats()
+            stats.add(elapsed, failed)
+
+    def count(self, kind, event):
+        """Count a cache event, e.g. ('DeviceDict', 'hit'). This happens
+        on every tree lookup, so each thread counts for itself, without
+        locking, and the counts are added up when a snapshot is made."""
+        try:
+            counter = self._local.counter
+        except AttributeError:
+            with self._lock:
+                counter = self._counters.setdefault(get_ident(), Counter())
+            self._local.counter = counter
+        counter[kind, event] += 1
+
+    def snapshot(self):
+        with self._lock:
+            caches = {}
+            for counter in self._counters.values():
+                # items() makes a copy, while the thread may be counting
+                for (kind, event), count in counter.items():
+                    events = caches.setdefault(kind, {})
+                    events[event] = events.get(event, 0) + count
+            return {"calls": dict((name, stats.to_dict())
+                                  for name, stats in self._calls.items()),
+                    "caches": caches}
+
+    def clear(self):
+        with self._lock:
+            self._calls.clear()
+            for counter in self._counters.values():
+                counter.clear()
+
+
+def format_json(report):
+    return json.dumps(report, indent=2, sort_keys=True) + "\n"
+
+
+def format_text(report):
+    "A human readable version of a report (as made by TangoFS.get_stats)"
+    lines = ["Backend calls:",
+             "  %-44s %8s %6s %10s %10s" % ("", "count", "errors",
+                                            "avg ms", "max ms")]
+    for name, stats in sorted(report["calls"].items()):
+        lines.append("  %-44s %8d %6d %10.2f %10.2f" % (
+            name, stats["count"], stats["errors"],
+            stats["total"] / stats["count"] * 1000 if stats["count"] else 0,
+            stats["max"] * 1000))
+    lines.append("Backend call latency:")
+    labels = bucket_labels()
+    totals = Counter()
+    for stats in report["calls"].values():
+        totals.update(stats["histogram"])
+    for label in labels:
+        lines.append("  %-10s %8d" % (label, totals[label]))
+    for section, values in sorted(report.items()):
+        if section == "calls":
+            continue
+        lines.append("%s:" % section.capitalize())
+        for name, value in sorted(values.items()):
+            if isinstance(value, dict):
+                value = ", ".join("%s=%s" % item
+                                  for item in sorted(value.items()))
+            lines.append("  %-20s %s" % (name, value))
+    return "\n".join(lines) + "\n"
+
+
+# The metrics of this process
+metrics = Metrics()
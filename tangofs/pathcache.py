@@ -0,0 +1,74 @@
+"""
+A cache of resolved filesystem paths, so that repeated lookups of
+the same path don't have to walk the tree from the root every time.
+"""
+
+from threading import RLock
+
+from ttldict import TTLDict
+
+
+MAX_SIZE = 100000  # number of paths to keep
+
+
+class PathCache(object):
+
+    """Maps FUSE paths (as strings, exactly as they come from FUSE)
+    to nodes in the Tango tree. A path and everything below it can be
+    invalidated in one go, e.g. when a subtree is modified. If a TTL
+    is given, entries also expire after that many seconds, so that
+    the cache never outlives the tree caches. When there are more than
+    max_size paths, the least recently used ones are dropped."""
+
+    def __init__(self, ttl=None, max_size=MAX_SIZE):
+        self._lock = RLock()
+        self._nodes = TTLDict(ttl or None, max_size=max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, path):
+        with self._lock:
+            try:
+                node = self._nodes[path]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            return node
+
+    def __setitem__(self, path, node):
+        with self._lock:
+            self._nodes[path] = node
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._nodes
+
+    def __len__(self):
+        with self._lock:
+            return len(self._nodes)
+
+    def invalidate(self, path):
+        "Forget a path and all paths below it"
+        path = path.rstrip("/")
+        prefix = path + "/"
+        with self._lock:
+            for key in list(self._nodes):
+                if key == path or key.startswith(prefix):
+                    del self._nodes[key]
+
+    def invalidate_if(self, test):
+        "Forget all paths for which test(path) is true"
+        with self._lock:
+            for key in list(self._nodes):
+                if test(key):
+                    del self._nodes[key]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._nodes), "hits": self.hits,
+                    "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._nodes.clear()
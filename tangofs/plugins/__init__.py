@@ -1,9 +1,30 @@
 """
 A hacky plugin system for file formatters
-"""
 
-# TODO: figure out a way to allow more than one plugin to work
-# on an attribute, e.g. by using different file extensions?
+Each plugin module declares which attributes it can handle:
+
+  DATA_FORMATS: a sequence of PyTango.AttrDataFormat values
+  DATA_TYPES: a sequence of PyTango.CmdArgType values, or None for any
+  EXTENSION: the file extension of its representation, e.g. "txt"
+  DEFAULT: False if it should not be used for the plain "value" file
+
+The plugins matching a given format and type are looked up once and
+then kept in a table, so finding the plugins for a value is a single
+dict lookup. Every matching plugin gives a "value.<EXTENSION>" file,
+and the first one allowed to be the default also gives "value".
+
+A plugin's convert(value, info) may also get keyword arguments from
+options given to tangofs, e.g. "level" for the "png" plugin.
+
+A plugin may also have estimate_size(info), giving the largest size
+its file can have for the attribute, so that it can be stat'ed without
+reading the value (see the --lazy-size option). Otherwise the size is
+guessed as for text.
+
+Plugins written the old way, with a check(info, data) function instead
+of the declarations and a convert(value) taking only the value, still
+work. Their check() is called for each attribute (with data None).
+"""
 
 import imp
 import logging
@@ -13,25 +34,92 @@ import glob
 
 plugins = []
 
+
+class LegacyPlugin(object):
+
+    """Wraps a plugin that decides for itself which attributes it can
+    handle, with check(info, data), and has convert(value)"""
+
+    def __init__(self, module):
+        self.module = module
+        self.__name__ = module.__name__
+        if hasattr(module, "EXTENSION"):
+            self.EXTENSION = module.EXTENSION
+        self.DEFAULT = getattr(module, "DEFAULT", True)
+
+    def check(self, info, data=None):
+        try:
+            return self.module.check(info, data)
+        except Exception as e:
+            logging.warning("Plugin '%s' failed to check '%s': %s",
+                            self.__name__, info.name, e)
+            return False
+
+    def convert(self, value, info=None, **options):
+        return self.module.convert(value)
+
+
 # register all modules in this directory, not very elegant
-for f in glob.glob(os.path.dirname(__file__)+"/*.py"):
+# (in alphabetical order, the first matching plugin is the default)
+for f in sorted(glob.glob(os.path.dirname(__file__)+"/*.py")):
     name = os.path.splitext(os.path.basename(f))[0]
     if name != "__init__":
         try:
             plugin = imp.load_source(name, f)
         except Exception as e:
-            pass  # TODO: handle broken plugins better
+            logging.warning("Could not load plugin '%s': %s", name, e)
+            continue  # TODO: handle broken plugins better
+        if not hasattr(plugin, "DATA_FORMATS"):
+            if not hasattr(plugin, "check"):
+                logging.warning("Plugin '%s' has neither DATA_FORMATS nor "
+                                "check(), it will not be used", name)
+                continue
+            plugin = LegacyPlugin(plugin)
         plugins.append(plugin)
 
+# (data_format, data_type) -> list of matching plugins
+_table = {}
+
+
+def handles(plugin, data_format, data_type):
+    "Check if a plugin declares that it can handle the format and type"
+    formats = getattr(plugin, "DATA_FORMATS", ())
+    types = getattr(plugin, "DATA_TYPES", None)
+    return data_format in formats and (types is None or data_type in types)
+
 
-def get_plugins(info, data):
+def lookup(data_format, data_type):
+    "Find the plugins for attributes of the given format and type"
+    key = (data_format, data_type)
+    try:
+        return _table[key]
+    except KeyError:
+        matches = [plugin for plugin in plugins
+                   if handles(plugin, data_format, data_type)]
+        logging.debug("Plugins for %s %s: %s", data_format, data_type,
+                      ", ".join(plugin.__name__ for plugin in matches))
+        _table[key] = matches
+        return matches
+
+
+def get_plugins(info, data=None):
     "Find any suitable plugins given an attribute info object"
-    matches = []
-    for plugin in plugins:
-        logging.debug("Testing plugin '%s' on '%s", plugin.__name__, info.name)
-        if plugin.check(info, data):
-            logging.debug("Plugin '%s' matches '%s'!", plugin.__name__, info.name)
-            matches.append(plugin)
-        else:
-            logging.debug("Plugin '%s' does not match '%s'.", plugin.__name__, info.name)
+    matches = lookup(info.data_format, info.data_type)
+    legacy = [plugin for plugin in plugins
+              if isinstance(plugin, LegacyPlugin) and plugin.check(info, data)]
+    if legacy:
+        # in the usual order, as the first one may be the default
+        matches = [plugin for plugin in plugins
+                   if plugin in matches or plugin in legacy]
     return matches
+
+
+def find_plugin(plugins, extension=None):
+    """Pick the plugin for a file extension out of a list of plugins,
+    or the default one if there is no extension."""
+    for plugin in plugins:
+        if extension is None:
+            if getattr(plugin, "DEFAULT", True):
+                return plugin
+        elif getattr(plugin, "EXTENSION", None) == extension:
+            return plugin
@@ -1,13 +1,24 @@
 """This is a dummy plugin intended as an example"""
 
 
-def check(info, value):
-    """Gets an AttributeInfo object and value, and should return True if
-    the plugin thinks it is able to handle the attribute."""
-    return False
+# The attribute data formats (PyTango.AttrDataFormat) that the plugin
+# is able to handle. This one handles nothing.
+DATA_FORMATS = ()
 
+# The data types (PyTango.CmdArgType) that the plugin is able to
+# handle, or None if it can handle any type.
+DATA_TYPES = None
 
-def convert(value):
-    """This function takes a Tango DeviceAttribute object and returns
-    a string (or bytes) which will be the contents of the file."""
+# The plugin's file is available as "value.<EXTENSION>"
+EXTENSION = "dummy"
+
+# Whether the plugin may be used for the plain "value" file. If several
+# plugins match, the first one (alphabetically) is used.
+DEFAULT = True
+
+
+def convert(value, info=None):
+    """This function takes a Tango DeviceAttribute object, and the
+    AttributeInfo of the attribute, and returns a string (or bytes)
+    which will be the contents of the file."""
     return str(value)
@@ -1,20 +1,23 @@
 "A 'plugin' that handles image attributes by converting them to a picture"
 
 
-import io
-
 import PyTango
-from scipy.misc import toimage
+
+from tangofs.formatting import DTYPES
+from tangofs.imaging import encode_png, png_size_bound
+
+
+EXTENSION = "png"
+DATA_FORMATS = (PyTango.AttrDataFormat.IMAGE,)
+DATA_TYPES = tuple(DTYPES)
 
 
-def check(info, data):
-    return info.data_format == PyTango.AttrDataFormat.IMAGE
+def convert(value, info=None, level=None):
+    """Convert an IMAGE type value into a PNG image, with the given
+    compression level (0-9) or the default one"""
+    return encode_png(value, level)
 
 
-def convert(value):
-    "Convert an IMAGE type value into a PNG image"
-    img = toimage(value)
-    with io.BytesIO() as s:
-        img.save(s, format="PNG")
-        image = s.getvalue()
-    return image
+def estimate_size(info):
+    "The size of the picture, if it doesn't compress at all"
+    return png_size_bound(info.max_dim_x, info.max_dim_y)
@@ -0,0 +1,15 @@
+"A 'plugin' that handles image attributes by converting them to text"
+
+
+import PyTango
+
+from tangofs.formatting import format_array
+
+
+EXTENSION = "txt"
+DATA_FORMATS = (PyTango.AttrDataFormat.IMAGE,)
+
+
+def convert(value, info=None):
+    "Convert an IMAGE type value into text, one row per line"
+    return format_array(value, info and info.format)
@@ -0,0 +1,41 @@
+"A 'plugin' that gives numeric attributes as NumPy .npy files"
+
+import io
+
+import numpy as np
+from numpy.lib import format as npformat
+import PyTango
+
+from tangofs.formatting import DTYPES, as_array, join_buffer, max_shape
+
+
+EXTENSION = "npy"
+DEFAULT = False  # only available as value.npy
+
+DATA_FORMATS = (PyTango.AttrDataFormat.SCALAR,
+                PyTango.AttrDataFormat.SPECTRUM,
+                PyTango.AttrDataFormat.IMAGE)
+DATA_TYPES = tuple(DTYPES)
+
+
+def _header(array_info):
+    header = io.BytesIO()
+    npformat.write_array_header_1_0(header, array_info)
+    return header.getvalue()
+
+
+def convert(value, info=None):
+    "Convert the value into the contents of a .npy file (see np.load)"
+    array = as_array(value, info)
+    return join_buffer(_header(npformat.header_data_from_array_1_0(array)),
+                       array)
+
+
+def estimate_size(info):
+    "The size of the file for the largest value the attribute can have"
+    dtype = np.dtype(DTYPES[info.data_type])
+    shape = max_shape(info)
+    # the header is padded, so a smaller shape never makes it longer
+    header = _header({"descr": npformat.dtype_to_descr(dtype),
+                      "fortran_order": False, "shape": shape})
+    return len(header) + dtype.itemsize * int(np.prod(shape))
@@ -0,0 +1,24 @@
+"A 'plugin' that converts image attributes to uncompressed PGM pictures"
+
+
+import PyTango
+
+from tangofs.formatting import DTYPES
+from tangofs.imaging import encode_pnm, pnm_size
+
+
+EXTENSION = "pgm"
+DEFAULT = False  # only available as value.pgm
+DATA_FORMATS = (PyTango.AttrDataFormat.IMAGE,)
+DATA_TYPES = tuple(DTYPES)
+
+
+def convert(value, info=None):
+    "Convert an IMAGE type value into a PGM image, fast but big"
+    return encode_pnm(value)
+
+
+def estimate_size(info):
+    "The size of the picture for the largest value the attribute can have"
+    depth = 2 if info.data_type == PyTango.CmdArgType.DevUShort else 1
+    return pnm_size(info.max_dim_x, info.max_dim_y, depth)
@@ -0,0 +1,36 @@
+"""A 'plugin' that gives numeric attributes as raw little-endian data.
+
+The data follows a one line ASCII header with the numpy type and the
+dimensions, separated by spaces, e.g. "<f8 480 640\\n" for a 640x480
+image of doubles. The data is in row-major order."""
+
+import numpy as np
+import PyTango
+
+from tangofs.formatting import DTYPES, as_array, join_buffer, max_shape
+
+
+EXTENSION = "raw"
+DEFAULT = False  # only available as value.raw
+
+DATA_FORMATS = (PyTango.AttrDataFormat.SCALAR,
+                PyTango.AttrDataFormat.SPECTRUM,
+                PyTango.AttrDataFormat.IMAGE)
+DATA_TYPES = tuple(DTYPES)
+
+
+def convert(value, info=None):
+    array = as_array(value, info)
+    dtype = array.dtype.newbyteorder("<")
+    if array.dtype != dtype:
+        array = array.astype(dtype)
+    header = " ".join([dtype.str] + [str(dim) for dim in array.shape])
+    return join_buffer(header + "\n", array)
+
+
+def estimate_size(info):
+    "The size of the file for the largest value the attribute can have"
+    dtype = np.dtype(DTYPES[info.data_type]).newbyteorder("<")
+    shape = max_shape(info)
+    header = " ".join([dtype.str] + [str(dim) for dim in shape])
+    return len(header) + 1 + dtype.itemsize * int(np.prod(shape))
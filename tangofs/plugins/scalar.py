@@ -3,9 +3,9 @@
 import PyTango
 
 
-def check(info, _):
-    return info.data_format == PyTango.AttrDataFormat.SCALAR
+EXTENSION = "txt"
+DATA_FORMATS = (PyTango.AttrDataFormat.SCALAR,)
 
 
-def convert(value):
+def convert(value, info=None):
     return str(value) + "\n"
@@ -3,14 +3,14 @@
 
 import PyTango
 
+from tangofs.formatting import format_array
 
-def check(info, data):
-    """Gets an AttributeInfo object and data, and should return True if
-    the plugin thinks it is able to handle the attribute data."""
-    return info.data_format == PyTango.AttrDataFormat.SPECTRUM
 
+EXTENSION = "txt"
+DATA_FORMATS = (PyTango.AttrDataFormat.SPECTRUM,)
 
-def convert(value):
+
+def convert(value, info=None):
     """This function takes a Tango DeviceAttribute object and returns
     a string or bytes."""
-    return "\n".join(str(v) for v in value) + "\n"
+    return format_array(value, info and info.format)
@@ -0,0 +1,142 @@
+"""
+Profiling of a running filesystem, turned on and off from inside it.
+
+cProfile only profiles the thread that enables it, and FUSE runs the
+operations in many threads. So, while profiling is on, each operation
+is run under a profiler belonging to its thread. When profiling is
+stopped, each thread that is in the middle of an operation collects
+its own profile when the operation is done. Then the profiles of all
+threads are merged into one result, kept in memory as a pstats file
+and a text summary.
+
+    $ echo start > mountpoint/.control/profile
+    $ ls -lR mountpoint/devices  # or whatever is slow
+    $ echo stop > mountpoint/.control/profile
+    $ python -m pstats mountpoint/.control/profile-20161016-101500.pstats
+"""
+
+from collections import OrderedDict
+import cProfile
+import marshal
+import pstats
+from StringIO import StringIO
+from thread import get_ident
+from threading import Lock
+from time import localtime, strftime, time
+
+
+MAX_RESULTS = 10  # number of profiling runs to keep the results of
+SUMMARY_LINES = 50  # number of functions in the text summary
+
+
+class Snapshot(object):
+
+    """The stats of a profile, taken by the thread it belongs to, in a
+    form that pstats can load"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass  # already done
+
+
+class Profiler(object):
+
+    def __init__(self):
+        self.running = False
+        self.started = None
+        self.results = OrderedDict()  # file name -> contents
+        self._profiles = {}  # thread id -> cProfile.Profile
+        self._busy = set()  # profiles running an operation right now
+        # stopped runs waiting for operations to finish, by result name:
+        # (profiles not collected yet, snapshots of the others)
+        self._stopping = {}
+        self._lock = Lock()
+
+    def start(self):
+        with self._lock:
+            if not self.running:
+                self._profiles = {}
+                self.started = time()
+                self.running = True
+
+    def stop(self):
+        """Stop profiling, returns the file names of the results. They
+        are stored once the operations in progress are done, as each
+        profile can only be safely stopped by its own thread."""
+        with self._lock:
+            if not self.running:
+                return []
+            self.running = False
+            name = "profile-" + strftime("%Y%m%d-%H%M%S")
+            profiles = set(self._profiles.values())
+            self._profiles = {}
+            if not profiles:
+                return []
+            idle = profiles - self._busy
+            self._stopping[name] = (profiles, [])
+        for profile in idle:
+            # not enabled, and never will be again, so it's safe to
+            # look at from here (unlike create_stats, which would
+            # disable profiling of *this* thread)
+            profile.snapshot_stats()
+            self._add_stats(name, profile)
+        return [name + ".pstats", name + ".txt"]
+
+    def runcall(self, func, *args):
+        "Run func under this thread's profiler, if still profiling"
+        ident = get_ident()
+        with self._lock:
+            if not self.running:
+                return func(*args)
+            profile = self._profiles.get(ident)
+            if profile is None:
+                profile = self._profiles[ident] = cProfile.Profile()
+            self._busy.add(profile)
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            with self._lock:
+                self._busy.discard(profile)
+                stopped = [name for name, (busy, _) in self._stopping.items()
+                           if profile in busy]
+            for name in stopped:
+                # profiling stopped meanwhile, this thread's part is done
+                profile.create_stats()
+                self._add_stats(name, profile)
+
+    def _add_stats(self, name, profile):
+        "Add a profile to a stopped run, and save it if it was the last"
+        with self._lock:
+            pending, stats = self._stopping[name]
+            pending.discard(profile)
+            if profile.stats:
+                stats.append(Snapshot(profile.stats))
+            if pending:
+                return
+            del self._stopping[name]
+        if stats:
+            self._save(name, stats)
+
+    def _save(self, name, snapshots):
+        "Merge the profiles of all threads and store the results"
+        stats = pstats.Stats(*snapshots)
+        summary = StringIO()
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(SUMMARY_LINES)
+        with self._lock:
+            self.results[name + ".pstats"] = marshal.dumps(stats.stats)
+            self.results[name + ".txt"] = summary.getvalue()
+            while len(self.results) > 2 * MAX_RESULTS:
+                self.results.popitem(last=False)
+
+    def status(self):
+        if self.running:
+            return "running since %s\n" % strftime(
+                "%Y-%m-%d %H:%M:%S", localtime(self.started))
+        return "stopped\n"
+
+
+# The profiler for this process
+profiler = Profiler()
@@ -0,0 +1,90 @@
+"""
+A pool of device proxies, shared by everything in the process that
+talks to devices, so that each device only gets one proxy no matter
+how many tree nodes refer to it or how often they are rebuilt.
+"""
+
+from collections import OrderedDict
+import logging
+from threading import RLock
+
+from batcher import ReadBatcher, WINDOW
+
+
+MAX_SIZE = 500  # number of proxies to keep around
+
+
+class ProxyPool(object):
+
+    """Keeps device proxies by canonical (lowercase) device name. When
+    the pool is full, the least recently used proxy is dropped. The
+    factory is called with a device name to create a new proxy. The
+    window is passed on to the read batchers of the proxies.
+
+    A proxy that is known to have failed can be discarded, and will
+    then be recreated (i.e. reconnected) next time it's needed."""
+
+    def __init__(self, factory, size=MAX_SIZE, window=WINDOW):
+        self.factory = factory
+        self.size = size
+        self.window = window
+        self._proxies = OrderedDict()
+        self._batchers = {}
+        self._lock = RLock()
+        self.hits = 0
+        self.creations = 0
+        self.evictions = 0
+        self.discards = 0
+
+    def get(self, devicename):
+        name = devicename.lower()
+        with self._lock:
+            proxy = self._proxies.pop(name, None)
+            if proxy is not None:
+                self.hits += 1
+                self._proxies[name] = proxy  # now most recently used
+                return proxy
+        # creating a proxy may take a while, so don't block others
+        proxy = self.factory(name)
+        with self._lock:
+            if name in self._proxies:
+                # someone else got there first, use theirs
+                return self._proxies[name]
+            self.creations += 1
+            self._proxies[name] = proxy
+            while len(self._proxies) > self.size:
+                old, _ = self._proxies.popitem(last=False)
+                self._batchers.pop(old, None)
+                self.evictions += 1
+            return proxy
+
+    def batcher(self, devicename):
+        "Return the read batcher for the device's proxy"
+        name = devicename.lower()
+        proxy = self.get(name)
+        with self._lock:
+            batcher = self._batchers.get(name)
+            if batcher is None or batcher.proxy is not proxy:
+                batcher = self._batchers[name] = ReadBatcher(
+                    proxy, self.window)
+            return batcher
+
+    def discard(self, devicename):
+        "Forget the proxy to a device, e.g. because it has failed"
+        name = devicename.lower()
+        with self._lock:
+            if self._proxies.pop(name, None) is not None:
+                logging.debug("discarding proxy to %s", name)
+                self.discards += 1
+            self._batchers.pop(name, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._proxies)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._proxies), "hits": self.hits,
+                    "creations": self.creations,
+                    "evictions": self.evictions,
+                    "discards": self.discards}
@@ -10,12 +10,20 @@ from functools import partial
 from itertools import chain
 import logging
 import re
+from threading import RLock
+from time import time
+from weakref import WeakValueDictionary
 
 
 import PyTango
 
-from ttldict import TTLDict
-from caseless import CaselessDictionary
+from caseless import CaselessTTLDict
+import events
+from plugins import get_plugins
+from health import DeviceHealth
+from metrics import metrics
+import tracing
+from proxypool import ProxyPool
 
 
 SERVER_REGEX = "^([_-\w]+)/([_-\w]+)$"
@@ -26,6 +34,36 @@ server_validator = lambda name, _: re.match(SERVER_REGEX, name)
 class_validator = lambda name, _: re.match(CLASS_REGEX, name)
 device_validator = lambda name, _: re.match(DEVICE_REGEX, name)
 
+MISSING = object()  # marks a missing key, since None is a valid value
+
+
+class NodeRegistry(object):
+
+    """Keeps track of tree nodes by their logical path, e.g.
+    ("device", "sys/tg_test/1"), so that each node only exists once
+    and its caches are shared no matter how it was reached. Nodes are
+    only kept as long as something else refers to them."""
+
+    def __init__(self):
+        self._nodes = WeakValueDictionary()
+        self._lock = RLock()
+
+    def get(self, key, factory):
+        "Return the node at key, creating it with factory if needed"
+        with self._lock:
+            node = self._nodes.get(key)
+            if node is None:
+                node = self._nodes[key] = factory()
+            return node
+
+    def find(self, key):
+        "Return the node at key, if there is one"
+        with self._lock:
+            return self._nodes.get(key)
+
+    def __len__(self):
+        return len(self._nodes)
+
 
 class AbstractTangoDict(dict):
 
@@ -46,20 +84,24 @@ class AbstractTangoDict(dict):
     child_type = None
     __metaclass__ = ABCMeta
 
-    def __init__(self, db=None, ttl=None, parent=None):
+    def __init__(self, db=None, ttl=None, parent=None, nodes=None):
         self._db = db
         self._ttl = ttl
         self._parent = parent
-        if ttl:
-            self._dict_class = partial(TTLDict, default_ttl=ttl)
-        else:
-            self._dict_class = CaselessDictionary
+        self._nodes = nodes if nodes is not None else NodeRegistry()
+        self._dict_class = partial(CaselessTTLDict, ttl or None)
+        self._cache = self._dict_class()
+
+    def forget(self):
+        "Drop the loaded children, to be loaded again when next needed"
         self._cache = self._dict_class()
 
     def refresh(self, recurse=False):
+        metrics.count(self.__class__.__name__, "loads")
         items = self.get_items_from_db()
-        self._cache = self._dict_class(**dict((str(name), None)
-                                              for name in items))
+        cache = self._dict_class()
+        cache.update((str(name), None) for name in items)
+        self._cache = cache
         if recurse:
             for item in self._cache.values():
                 item and item.refresh(True)
@@ -79,14 +121,26 @@ class AbstractTangoDict(dict):
     @property
     def parent(self):
         try:
-            if self._parent:
+            if self._parent is not None:
                 return self._parent
         except (TypeError, ReferenceError):
             pass
-        parent = self.make_parent
+        parent = self.make_parent()
         self._parent = parent  # a weak reference to loosen circularity..?
         return parent
 
+    def get_servers(self):
+        "The (one) node with all the servers"
+        return self._nodes.get(("servers",), partial(
+            ServersDict, self._db, ttl=self._ttl, nodes=self._nodes))
+
+    def get_device(self, devicename, parent=None):
+        "The (one) node for a device, wherever it's found in the tree"
+        name = devicename.lower()
+        return self._nodes.get(("device", name), partial(
+            DeviceDict, self._db, name, ttl=self._ttl, parent=parent,
+            nodes=self._nodes))
+
     @property
     def path(self):
         return self.parent.path + (self.name,)
@@ -100,12 +154,15 @@ class AbstractTangoDict(dict):
         if not self._cache:
             self.refresh()
         try:
-            if name not in self._cache:
+            item = self._cache.get(name, MISSING)
+            if item is MISSING:
                 raise KeyError("No such child to %s" % self.name)
-            item = self._cache.get(name)
             if item is None:
+                metrics.count(self.__class__.__name__, "misses")
                 item = self.make_child(name)
                 self._cache[name] = item
+            else:
+                metrics.count(self.__class__.__name__, "hits")
             return item
         except (ValueError, PyTango.DevFailed) as e:
             raise KeyError(e)
@@ -161,53 +218,120 @@ class AbstractTangoDict(dict):
     #     print "GC", self.name, self.parent._cache.get(self.name)
 
 
+class DeviceIndex(object):
+
+    """Holds the whole domain/family/member hierarchy of device names.
+    It is fetched from the DB in a single wildcard query, instead of
+    one query per domain and family, and then served locally. With a
+    TTL, the whole index is reloaded at once when it has expired."""
+
+    def __init__(self, db, ttl=None):
+        self._db = db
+        self._ttl = ttl
+        self._tree = None
+        self._loaded = 0
+        self._lock = RLock()
+
+    def refresh(self):
+        result = self._db.get_device_name("*", "*")
+        tree = {}
+        for name in result.value_string:
+            try:
+                domain, family, member = name.lower().split("/")
+            except ValueError:
+                logging.debug("ignoring malformed device name %r", name)
+                continue
+            tree.setdefault(domain, {}).setdefault(family, set()).add(member)
+        with self._lock:
+            self._tree = tree
+            self._loaded = time()
+
+    @property
+    def tree(self):
+        with self._lock:
+            if self._tree is None or (
+                    self._ttl and time() - self._loaded > self._ttl):
+                self.refresh()
+            return self._tree
+
+    def domains(self):
+        return list(self.tree)
+
+    def families(self, domain):
+        return list(self.tree.get(domain.lower(), {}))
+
+    def members(self, domain, family):
+        families = self.tree.get(domain.lower(), {})
+        return list(families.get(family.lower(), ()))
+
+
 class DomainsDict(AbstractTangoDict):
 
     child_type = "domain"
     name = "domains"
 
+    def __init__(self, db, index=None, **kwargs):
+        self._index = index
+        super(DomainsDict, self).__init__(db, **kwargs)
+
+    def refresh(self, recurse=False):
+        if self._index:
+            # reload everything below us in one go
+            self._index.refresh()
+        super(DomainsDict, self).refresh(recurse)
+
     def get_items_from_db(self):
+        if self._index:
+            return self._index.domains()
         result = self._db.get_device_domain("*")
         return [s.lower() for s in result.value_string]
 
     def make_child(self, domain):
-        return FamiliesDict(self._db, domain, parent=self)
+        return FamiliesDict(self._db, domain, index=self._index, parent=self,
+                            nodes=self._nodes)
 
 
 class FamiliesDict(AbstractTangoDict):
 
     child_type = "family"
 
-    def __init__(self, db, domain, **kwargs):
+    def __init__(self, db, domain, index=None, **kwargs):
         self.name = domain
+        self._index = index
         super(FamiliesDict, self).__init__(db, **kwargs)
 
     def get_items_from_db(self):
+        if self._index:
+            return self._index.families(self.name)
         result = self._db.get_device_family(self.name + "/*")
         families = result.value_string
         return [f.lower() for f in families]
 
     def make_child(self, family):
-        return MembersDict(self._db, self.name, family, parent=self)
+        return MembersDict(self._db, self.name, family, index=self._index,
+                           parent=self, nodes=self._nodes)
 
 
 class MembersDict(AbstractTangoDict):
 
     child_type = "member"
 
-    def __init__(self, db, domain, family, **kwargs):
+    def __init__(self, db, domain, family, index=None, **kwargs):
         self.domain = domain
         self.name = family
+        self._index = index
         super(MembersDict, self).__init__(db, **kwargs)
 
     def get_items_from_db(self):
+        if self._index:
+            return self._index.members(self.domain, self.name)
         result = self._db.get_device_member(self.domain + "/" + self.name + "/*")
         members = result.value_string
         return [m.lower() for m in members]
 
     def make_child(self, member):
         devname = "{0}/{1}/{2}".format(self.domain, self.name, member)
-        return DeviceDict(self._db, devname, parent=self)
+        return self.get_device(devname, parent=self)
 
 
 class ServersDict(AbstractTangoDict):
@@ -220,7 +344,8 @@ class ServersDict(AbstractTangoDict):
         return result.value_string
 
     def make_child(self, servername):
-        return ServerDict(self._db, servername, ttl=self._ttl, parent=self)
+        return ServerDict(self._db, servername, ttl=self._ttl, parent=self,
+                          nodes=self._nodes)
 
     def make_parent(self):
         pass
@@ -259,9 +384,7 @@ class ServerDict(AbstractTangoDict):
     child_type = "instance"
 
     def __init__(self, db, name, **kwargs):
-        servers = db.get_server_name_list()
-        if name not in servers:
-            raise KeyError("No server named '%s'!" % name)
+        # only made by the parent, which knows if the server exists
         self.name = name
         AbstractTangoDict.__init__(self, db, **kwargs)
 
@@ -271,10 +394,10 @@ class ServerDict(AbstractTangoDict):
 
     def make_child(self, instancename):
         return InstanceDict(self._db, self.name, instancename, ttl=self._ttl,
-                            parent=self)
+                            parent=self, nodes=self._nodes)
 
     def make_parent(self):
-        return ServersDict(self._db, self._ttl)
+        return self.get_servers()
 
     def add(self, instname, classname, devices):
         self.parent.add(self.name, instname, classname, devices)
@@ -297,10 +420,7 @@ class InstanceDict(AbstractTangoDict):
     child_type = "class"
 
     def __init__(self, db, servername, name, **kwargs):
-        insts = db.get_instance_name_list(servername)
-        if name not in insts:
-            raise KeyError("Server '%' has no instance '%s'!" %
-                           (servername, name))
+        # only made by the parent, which knows if the instance exists
         self.servername = servername
         self.name = name
         self._info = None
@@ -320,10 +440,11 @@ class InstanceDict(AbstractTangoDict):
 
     def make_child(self, classname):
         return ClassDict(self._db, self.servername, self.name,
-                         classname, ttl=self._ttl, parent=self)
+                         classname, ttl=self._ttl, parent=self,
+                         nodes=self._nodes)
 
     def make_parent(self):
-        return ServerDict(self._db, self.servername, ttl=self._ttl)
+        return self.get_servers()[self.servername]
 
     def add(self, classname, devices):
         self.parent.add(self.name, classname, devices)
@@ -351,11 +472,10 @@ class ClassDict(AbstractTangoDict):
         return [s.lower() for s in result.value_string]
 
     def make_child(self, devicename):
-        return DeviceDict(self._db, devicename, ttl=self._ttl, parent=self)
+        return self.get_device(devicename, parent=self)
 
     def make_parent(self):
-        return InstanceDict(self._db, self.servername, self.instancename,
-                            ttl=self._ttl)
+        return self.get_servers()[self.servername][self.instancename]
 
     def add(self, devices):
         self.parent.add(self.name, devices)
@@ -372,42 +492,31 @@ class DeviceDict(AbstractTangoDict):
     def __init__(self, db, name, **kwargs):
         self.name = name.lower()
         self._info = None
-        self._proxy = None
         AbstractTangoDict.__init__(self, db, **kwargs)
 
     def make_child(self, name):
+        name = name.lower()
         if name == "properties":
-            return PropertiesDict(self._db, self.name, parent=self, ttl=self._ttl)
+            return PropertiesDict(self._db, self.name, parent=self,
+                                  ttl=self._ttl, nodes=self._nodes)
 
         # TODO: this is awkward
-        elif name == "attributes" and self.proxy:
-            try:
-                self.proxy.ping()
-                return AttributesDict(self._db, self.name, parent=self, ttl=self._ttl)
-            except PyTango.DevFailed:
-                logging.debug("cannot communicate with device %s", self.name)
-                return
-        elif name == "commands" and self.proxy:
-            try:
-                self.proxy.ping()
-                return CommandsDict(self._db, self.name, parent=self, ttl=self._ttl)
-            except PyTango.DevFailed:
-                logging.debug("cannot communicate with device %s", self.name)
-                return
+        elif name == "attributes" and health.is_up(self.name):
+            return AttributesDict(self._db, self.name, parent=self,
+                                  ttl=self._ttl, nodes=self._nodes)
+        elif name == "commands" and health.is_up(self.name):
+            return CommandsDict(self._db, self.name, parent=self,
+                                ttl=self._ttl, nodes=self._nodes)
 
     def get_items_from_db(self):
-        if self.proxy:
-            try:
-                self.proxy.ping()
-                return ["properties", "attributes", "commands"]
-            except PyTango.DevFailed:
-                pass
+        if health.is_up(self.name):
+            return ["properties", "attributes", "commands"]
         return ["properties"]
 
     def make_parent(self):
         cls = self.info.class_name
         srv, inst = self.info.ds_full_name.split("/")
-        return ClassDict(self._db, srv, inst, cls, ttl=self._ttl)
+        return self.get_servers()[srv][inst][cls]
 
     @property
     def path(self):
@@ -415,17 +524,17 @@ class DeviceDict(AbstractTangoDict):
 
     @property
     def proxy(self):
-        if self._proxy:
-            return self._proxy
         try:
-            self._proxy = ObjectWrapper(
-                PyTango.DeviceProxy(self.name),
-                logger=logging.getLogger("DeviceProxy(%s)" % self.name))
-            return self._proxy
+            return proxies.get(self.name)
         except PyTango.DevFailed:
             logging.debug("cannot create proxy to device %s", self.name)
             pass
 
+    @property
+    def batcher(self):
+        "Coalesces concurrent attribute reads on this device"
+        return proxies.batcher(self.name)
+
     @property
     def info(self):
         if not self._info:
@@ -436,7 +545,9 @@ class DeviceDict(AbstractTangoDict):
         return self._info
 
     def delete(self):
-        self.parent.delete(self.name)
+        # the node may have been reached through the devices tree first,
+        # but devices are deleted by their class in the servers tree
+        self.make_parent().delete(self.name)
 
     # def refresh(self, recurse=False):
     #     self._info = self._db.get_device_info(self.name)
@@ -454,23 +565,30 @@ class AttributesDict(AbstractTangoDict):
     def __init__(self, db, devicename, **kwargs):
         self.devicename = devicename
         self.name = "attributes"
-        self._infos = None
+        self._infos = CaselessTTLDict(None)  # attribute name -> config
         AbstractTangoDict.__init__(self, db, **kwargs)
 
     def get_items_from_db(self):
         attrs = self.parent.proxy.get_attribute_list()
         # More efficient to read all info in one call than to do it for
         # each child (assuming that the children will eventually be created)
-        self._infos = self.parent.proxy.get_attribute_config(attrs)
+        infos = CaselessTTLDict(None)
+        for info in self.parent.proxy.get_attribute_config(attrs):
+            infos[info.name] = info
+        self._infos = infos
         return list(attrs)
 
+    def get_info(self, attrname):
+        "The config of an attribute, preferably from the bulk loaded ones"
+        info = self._infos.get(attrname)
+        if info is None:
+            info = self[attrname].info
+        return info
+
     def make_child(self, attrname):
-        info = None
-        for info in self._infos:
-            if attrname.lower() == info.name.lower():
-                break
+        # if the config is not known, the attribute will read it itself
         return DeviceAttribute(self.devicename, attrname, self.parent,
-                               info=info)
+                               info=self._infos.get(attrname))
 
 
 class DeviceAttribute(object):
@@ -484,6 +602,7 @@ class DeviceAttribute(object):
         #self.data = self._attribute.read()
         self._last_read = 0
         self._value = None
+        self._plugins = None
 
     @property
     def info(self):
@@ -492,18 +611,30 @@ class DeviceAttribute(object):
         self._info = self.parent.proxy.get_attribute_config(self.name)
         return self._info
 
+    @property
+    def plugins(self):
+        "The plugins that can format the value of this attribute"
+        # the data format and type of an attribute don't change
+        if self._plugins is None:
+            self._plugins = get_plugins(self.info)
+        return self._plugins
+
     def set_config(self, attr, value):
         setattr(self.info, attr, value)
         self.parent.proxy.set_attribute_config(self.info)
 
     def keys(self):
+        # each plugin gives a representation of the value
+        extensions = [plugin.EXTENSION for plugin in self.plugins
+                      if hasattr(plugin, "EXTENSION")]
         keys = (["value", "polling_period", "polling_status"] +
+                ["value." + ext for ext in extensions] +
                 [attr for attr in dir(self.info)
                  if not attr.startswith("__") and
                  # don't know what these are for...
                  attr not in ["extensions", "writable_attr_name"]])
         if self.info.writable == PyTango.AttrWriteType.WRITE:
-            keys += ["w_value"]
+            keys += ["w_value"] + ["w_value." + ext for ext in extensions]
         return keys
 
     @property
@@ -539,9 +670,21 @@ class DeviceAttribute(object):
         if status:
             return status[0]
 
+    def read(self):
+        "Read the attribute, from the event cache if possible"
+        cache = events.get_cache()
+        if cache:
+            # raises, like the batcher does, if there can be no proxy
+            # (the parent's proxy property gives None instead)
+            proxy = proxies.get(self.devicename)
+            reading = cache.read(proxy, self.devicename, self.name)
+            if reading is not None:
+                return reading
+        return self.parent.batcher.read(self.name)
+
     @property
     def value(self):
-        self._value = self.parent.proxy.read_attribute(self.name).value
+        self._value = self.read().value
         return self._value
 
     @value.setter
@@ -550,7 +693,7 @@ class DeviceAttribute(object):
 
     @property
     def w_value(self):
-        self._w_value = self.parent.proxy.read_attribute(self.name).w_value
+        self._w_value = self.read().w_value
         return self._w_value
 
     @w_value.setter
@@ -662,17 +805,11 @@ class CommandsDict(AbstractTangoDict):
         self._db = db
         self.devicename = devicename
         self.name = "commands"
-        self._proxy = None
         AbstractTangoDict.__init__(self, db, **kwargs)
 
     @property
     def proxy(self):
-        if self._proxy:
-            return self._proxy
-        self._proxy = ObjectWrapper(
-            PyTango.DeviceProxy(self.devicename),
-            logger=logging.getLogger("DeviceProxy(%s)" % self.name))
-        return self._proxy
+        return proxies.get(self.devicename)
 
     def get_items_from_db(self):
         commands = self.proxy.command_list_query()
@@ -710,19 +847,35 @@ class PropertiesDict(AbstractTangoDict):
     def __init__(self, db, devicename, **kwargs):
         self._db = db
         self.devicename = devicename
+        self._values = CaselessTTLDict(None)
+        self._histories = CaselessTTLDict(None)
         AbstractTangoDict.__init__(self, db, **kwargs)
 
     def get_items_from_db(self):
         result = self._db.get_device_property_list(self.devicename, "*")
-        return result.value_string
+        names = list(result.value_string)
+        # More efficient to read all values and history in one call each
+        # than to do it for each child (which is what happens as soon as
+        # someone does e.g. "ls -l" or "head *")
+        values = CaselessTTLDict(None)
+        if names:
+            values.update(self._db.get_device_property(self.devicename,
+                                                       names))
+        histories = CaselessTTLDict(None)
+        for hist in self._db.get_device_property_history(self.devicename,
+                                                         "*"):
+            histories.setdefault(hist.get_name(), []).append(hist)
+        self._values, self._histories = values, histories
+        return names
 
     def make_child(self, propertyname):
         return DeviceProperty(self._db, self.devicename, propertyname,
-                              parent=self)
+                              parent=self,
+                              value=self._values.get(propertyname),
+                              history=self._histories.get(propertyname))
 
     def make_parent(self):
-        return DeviceDict(self._db, self.devicename,
-                          ttl=self._ttl)
+        return self.get_device(self.devicename)
 
     def to_dict(self):
         return dict((name, prop.value)
@@ -746,13 +899,14 @@ class PropertiesDict(AbstractTangoDict):
 
 class DeviceProperty(object):
 
-    def __init__(self, db, devicename, name, parent=None):
+    def __init__(self, db, devicename, name, parent=None, value=None,
+                 history=None):
         self._db = db
         self.devicename = devicename
         self.name = name
         self._parent = parent
-        self._history = None
-        self._value = None
+        self._history = history
+        self._value = list(value) if value is not None else None
         #self.refresh()
 
     # def refresh(self):
@@ -789,6 +943,11 @@ class DeviceProperty(object):
     def parent(self):
         return self._parent
 
+    @property
+    def is_loaded(self):
+        "Whether value and history are available without DB calls"
+        return self._value is not None and bool(self._history)
+
     def __len__(self):
         return len(self.value)
 
@@ -805,7 +964,8 @@ class DeviceProperty(object):
 class ObjectWrapper(object):
 
     """An object that allows all method calls and records them,
-    then passes them on to a target object (if any)."""
+    then passes them on to a target object (if any). The calls are
+    counted and timed in the metrics."""
 
     def __init__(self, target=None, keep=False, logger=False):
         self.target = target
@@ -822,31 +982,64 @@ class ObjectWrapper(object):
             call = (attr, args, kwargs)
             if self.keep:
                 self.calls.append(call)
-            if self.logger:
+            # formatting the call is not free, only do it if needed
+            if self._logger and self._logger.isEnabledFor(logging.DEBUG):
                 fmt = "%s(%s)" % (attr,
                                   ", ".join(chain(("%r" % a for a in args),
                                                   ("%s=%r" % i
                                                    for i in kwargs.items()))))
                 self._logger.debug(fmt)
             if self.target:
-                return getattr(self.target, attr)(*args, **kwargs)
+                name = "%s.%s" % (type(self.target).__name__, attr)
+                start = time()
+                failed = True
+                try:
+                    with tracing.span(name, "tango"):
+                        result = getattr(self.target, attr)(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    metrics.add_call(name, time() - start, failed)
 
         return partial(method, attr)
 
 
+def make_proxy(devicename):
+    return ObjectWrapper(
+        PyTango.DeviceProxy(devicename),
+        logger=logging.getLogger("DeviceProxy(%s)" % devicename))
+
+
+# All device proxies in the process come from here
+proxies = ProxyPool(make_proxy)
+
+# ...and this knows which of the devices can be reached
+health = DeviceHealth(proxies)
+
+
 class TangoDict(dict):
 
-    def __init__(self, ttl=None, db=None, *args, **kwargs):
+    def __init__(self, ttl=None, db=None, bulk_index=False, *args, **kwargs):
         logger = logging.getLogger("tangodb")
         self._db = db or ObjectWrapper(PyTango.Database(), logger=logger)
         self.logger = logger
-        self["servers"] = ServersDict(self._db, ttl=ttl)
-        self["devices"] = DomainsDict(self._db, ttl=ttl)
-        self.nodes = {}
+        index = DeviceIndex(self._db, ttl=ttl) if bulk_index else None
+        self.nodes = NodeRegistry()  # every node in the tree, by path
+        self["servers"] = self.nodes.get(("servers",), partial(
+            ServersDict, self._db, ttl=ttl, nodes=self.nodes))
+        self["devices"] = DomainsDict(self._db, index=index, ttl=ttl,
+                                      nodes=self.nodes)
 
     def refresh(self):
         self["servers"].refresh(recurse=True)
 
+    def forget_device(self, devicename):
+        """Make the device reload its children, e.g. because it went
+        down or came back up, which changes what it has"""
+        device = self.nodes.find(("device", devicename.lower()))
+        if device is not None:
+            device.forget()
+
     def to_dict(self):
         return {"servers": self["servers"].to_dict()}
 
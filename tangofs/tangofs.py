@@ -1,5 +1,7 @@
-from errno import ENOENT, EPERM, EINVAL  # lots of meaningful errors here!
+# lots of meaningful errors here!
+from errno import ENOENT, EPERM, EINVAL, EIO, EBADF, EISDIR, EACCES
 from datetime import datetime
+import logging
 import os
 import re
 import stat
@@ -7,13 +9,22 @@ from time import time
 
 from dateutil import parser
 from fuse import FuseOSError, LoggingMixIn, Operations
+import numpy as np
 import PyTango
 
 from tangodict import (ServersDict, ClassDict, DeviceAttribute, DeviceCommand,
                        DeviceDict, DeviceProperty, InstanceDict,
                        PropertiesDict, TangoDict, ServerDict,
-                       AttributesDict)
-from plugins import get_plugins
+                       AttributesDict, CommandsDict, DomainsDict,
+                       FamiliesDict, proxies, health)
+from formatting import DTYPES, as_array, element_format
+from pathcache import PathCache
+from plugins import find_plugin
+from handles import ContentCache, FileHandles
+from metrics import metrics, format_json, format_text
+from profiling import profiler
+import events
+import tracing
 from . import __path__
 
 
@@ -31,6 +42,50 @@ SERVER = 0
 CLASS = 1
 PROPERTY = 2
 
+# Read-only files at the root with statistics, and their formatters
+STATS_FILES = {"/.stats": format_text, "/.stats.json": format_json}
+READ_ONLY_FILE = stat.S_IFREG | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+# A directory of files for controlling the filesystem while it's mounted,
+# and that also holds their results (e.g. profiles)
+CONTROL_DIR = "/.control"
+PROFILE_FILE = CONTROL_DIR + "/profile"  # write "start" or "stop"
+
+# How long stat info collected by readdir is trusted by getattr
+STAT_TTL = 2.0
+
+# Attribute files whose contents are not part of the attribute config
+DYNAMIC_ATTRIBUTE_FILES = ("value", "w_value",
+                           "polling_period", "polling_status")
+
+# Value files, optionally of just a part of the value and/or in a
+# given format, e.g. "value[100:200]" or "w_value[0:10,20:30].png"
+VALUE_FILE = re.compile(r"^(value|w_value)"
+                        r"(?:\[([-\d:, ]*)\])?"  # optional index
+                        r"(?:\.(\w+))?$")  # optional extension
+
+# number of dimensions of a value, by data format
+DIMENSIONS = {
+    PyTango.AttrDataFormat.SPECTRUM: 1,
+    PyTango.AttrDataFormat.IMAGE: 2,
+}
+
+
+# Rough upper bounds on the length of one value as text, by data type
+TEXT_WIDTH = {
+    PyTango.CmdArgType.DevBoolean: 6,
+    PyTango.CmdArgType.DevUChar: 4,
+    PyTango.CmdArgType.DevShort: 7,
+    PyTango.CmdArgType.DevUShort: 6,
+    PyTango.CmdArgType.DevLong: 12,
+    PyTango.CmdArgType.DevULong: 11,
+    PyTango.CmdArgType.DevLong64: 21,
+    PyTango.CmdArgType.DevULong64: 21,
+    PyTango.CmdArgType.DevState: 12,
+    PyTango.CmdArgType.DevString: 256,
+}
+DEFAULT_TEXT_WIDTH = 25  # enough for a float or a double
+
 
 def unix_time(dt):
     epoch = datetime.utcfromtimestamp(0)
@@ -38,21 +93,117 @@ def unix_time(dt):
     return delta.total_seconds()
 
 
+def parse_index(spec, dimensions):
+    """Turn e.g. "10:20" or "0:5,100:" into an index for an array with
+    the given number of dimensions (images are indexed row first). A
+    single number becomes a slice too, so that dimensions are kept.
+    Raises ValueError if the spec doesn't make sense."""
+    index = []
+    for part in spec.split(","):
+        bounds = [int(b) if b.strip() else None for b in part.split(":")]
+        if len(bounds) == 1:
+            start = bounds[0]
+            if start is None:
+                raise ValueError("empty index")
+            bounds = [start, start + 1 or None]
+        elif len(bounds) > 3 or bounds[2:] == [0]:
+            raise ValueError("bad slice %r" % part)
+        index.append(slice(*bounds))
+    if len(index) > dimensions:
+        raise ValueError("too many indices")
+    return tuple(index)
+
+
+def estimate_size(info, plugin=None):
+    """Guess the largest size a value file of the attribute can have,
+    without reading it. The plugin making the file may know best."""
+    if hasattr(plugin, "estimate_size"):
+        return plugin.estimate_size(info)
+    count = max(info.max_dim_x, 1) * max(info.max_dim_y, 1)
+    width = TEXT_WIDTH.get(info.data_type, DEFAULT_TEXT_WIDTH)
+    dtype = DTYPES.get(info.data_type)
+    if dtype is not None and np.dtype(dtype).kind in "iu":
+        # integers may be formatted wider, e.g. with "%6.2f"
+        limits = np.array([np.iinfo(dtype).min, np.iinfo(dtype).max], dtype)
+        fmt = element_format(info.format, limits)
+        if fmt:
+            width = max([width] + [len(fmt % x) + 1 for x in limits.tolist()])
+    return count * width
+
+
 class TangoFS(LoggingMixIn, Operations):
 
     "A FUSE filsystem representing a Tango control system"
 
-    def __init__(self):
-        self.tree = TangoDict()  # Tango interaction layer
-        self.tmp = {}
-        # tmp is for keeping track of temporary stuff "in flight"
+    def __init__(self, ttl=None, bulk_index=False, event_timeout=None,
+                 lazy_size=False, direct_io=False, png_level=None, db=None,
+                 batch_window=None):
+        if event_timeout:
+            # serve watched attribute values from events
+            events.enable(event_timeout)
+        if batch_window is not None:
+            # wait for concurrent attribute reads to join up
+            proxies.window = batch_window
+        # Tango interaction layer
+        self.tree = TangoDict(ttl=ttl, db=db, bulk_index=bulk_index)
+        # things that are being created, but don't exist in the DB yet
+        self.pending = {}
+        # temporary files (e.g. from sed -i) that only live here
+        self.tmpfiles = {}
+        self.handles = FileHandles()  # open files
+        self._leftovers = ContentCache()  # contents read by getattr
+        # converted attribute values, by the time they were read
+        self._converted = ContentCache(max_age=None)
+        self._paths = PathCache(ttl)  # resolved paths -> tree nodes
+        self._stats = PathCache(STAT_TTL)  # stat info found by readdir
+        self._readings = PathCache(STAT_TTL)  # attribute values read on stat
+        # If lazy_size is set, attribute values are not read on stat
+        # but on open. With direct_io the size is not needed at all.
+        self.lazy_size = lazy_size
+        self.direct_io = direct_io
+        # keyword arguments for the plugins' convert(), by extension
+        self.plugin_options = {}
+        if png_level is not None:
+            self.plugin_options["png"] = {"level": png_level}
+        # what a device has depends on whether it's up
+        health.add_listener(self._device_changed)
 
     def _get_path(self, path):
+        try:
+            return self._paths[path]
+        except KeyError:
+            pass
         # decode device slashes
         p = [str(part.replace("%", "/")) for part in path[1:].split("/")]
         target = self.tree.get_path(p)
+        if target is None:
+            # e.g. the attributes of a device that is down; it may
+            # be back later, so don't remember that
+            raise KeyError(path)
+        self._paths[path] = target
         return target
 
+    def _device_changed(self, devicename):
+        "Forget what's cached about a device that went down or came up"
+        self.tree.forget_device(devicename)
+        name = devicename.lower()
+        in_devices = "/devices/" + name
+        in_servers = "/" + name.replace("/", "%")
+
+        def affected(path):
+            path = path.lower()
+            return (path == in_devices or path.startswith(in_devices + "/")
+                    or in_servers + "/" in path + "/")
+
+        self._paths.invalidate_if(affected)
+        self._stats.invalidate_if(affected)
+
+    def _invalidate(self, path):
+        "Forget anything cached about a path and whatever is below it"
+        self._paths.invalidate(path)
+        self._stats.invalidate(path)
+        self._readings.invalidate(path)
+
     @staticmethod
     def make_node(mode, size=0, timestamp=None):
         # TODO: find out the meaning of all this and use it for something
@@ -74,14 +225,217 @@ class TangoFS(LoggingMixIn, Operations):
             'st_blocks': int((size + 511) / 512)
         }
 
+    def _attribute_node(self, info):
+        # set mode accordingbi to whether the attr is read/writable
+        mode = stat.S_IFDIR | stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH
+        if info.writable != PyTango.AttrWriteType.READ:
+            mode |= (stat.S_IWRITE | stat.S_IWGRP | stat.S_IWOTH)
+        return self.make_node(mode=mode)
+
+    def _property_node(self, prop):
+        "Returns the contents of a property file, and its node"
+        # use last history date as timestamp
+        timestamp = parser.parse(prop.history[-1].get_date())
+        value = "\n".join(prop.value) + "\n"
+        return value, self.make_node(
+            mode=stat.S_IFREG, timestamp=unix_time(timestamp),
+            size=len(value))
+
+    def _command_node(self, command):
+        "Returns the contents of a command executable, and its node"
+        exe = EXE.format(device=command.devicename, command=command.name)
+        return exe, self.make_node(mode=stat.S_IFREG | 755, size=len(exe))
+
+    def _value_plugin(self, target, spec, extension):
+        """Returns the plugin making a value file of the attribute, and
+        the index of the part of the value it has, if any. Raises ENOENT
+        if there's no such file."""
+        # e.g. value.npy is given by the plugin with that extension
+        plugin = find_plugin(target.plugins, extension or None)
+        if plugin is None:
+            raise FuseOSError(ENOENT)
+        index = None
+        if spec is not None:
+            # Tango can't read part of an attribute, but slicing
+            # before converting saves formatting the rest of it.
+            dimensions = DIMENSIONS.get(target.info.data_format, 0)
+            try:
+                index = parse_index(spec, dimensions)
+            except ValueError:
+                raise FuseOSError(ENOENT)
+        return plugin, index
+
+    def _attribute_file(self, target, child, reading=None):
+        """Returns the contents of a file in an attribute directory. The
+        value files are made from the given reading, if any."""
+        match = VALUE_FILE.match(child)
+        if match:
+            name, spec, extension = match.groups()
+            plugin, index = self._value_plugin(target, spec, extension)
+            if reading is None:
+                reading = target.read()
+            # Converting e.g. a big image to PNG is slow, and the same
+            # reading may come back many times, from events or from a
+            # device that doesn't update that often.
+            key = (target.devicename, target.name, name, spec,
+                   plugin.__name__)
+            stamp = reading.time.totime() if reading.time else None
+            if stamp is not None:
+                contents = self._converted.get(key, stamp)
+                if contents is not None:
+                    return contents
+            data = getattr(reading, name)
+            try:
+                if index is not None:
+                    data = as_array(data, target.info)[index]
+                options = self.plugin_options.get(
+                    getattr(plugin, "EXTENSION", None), {})
+                contents = plugin.convert(data, target.info, **options)
+            except Exception as e:
+                self.log.error("Decoding failed: %s", e)
+                raise FuseOSError(EIO)
+            if stamp is not None:
+                self._converted.put(key, contents, stamp)
+            return contents
+        # TODO: How about quality?
+        return str(getattr(target, child))
+
+    def _shared_reading(self, path, target):
+        """Read the attribute at path to stat one of its value files.
+        The value files share the reading until one of them is opened,
+        or for a little while, so that e.g. "ls -l" reads the attribute
+        once, not once for each format it's available in. Returns the
+        reading, and whether it was shared."""
+        try:
+            return self._readings[path], True
+        except KeyError:
+            reading = self._readings[path] = target.read()
+            return reading, False
+
+    def get_stats(self):
+        "Statistics about backend calls and caches, for the stats files"
+        report = metrics.snapshot()
+        report["caches"].update(paths=self._paths.stats(),
+                                prefilled_stats=self._stats.stats(),
+                                readings=self._readings.stats())
+        report["files"] = {"open": len(self.handles),
+                           "leftovers": self._leftovers.stats(),
+                           "converted": self._converted.stats()}
+        report["proxies"] = proxies.stats()
+        report["health"] = health.stats()
+        return report
+
+    def _control_contents(self, path):
+        "Returns the contents of a file in the control directory"
+        if path == PROFILE_FILE:
+            return profiler.status()
+        name = path[len(CONTROL_DIR) + 1:]
+        try:
+            return profiler.results[name]
+        except KeyError:
+            raise FuseOSError(ENOENT)
+
+    @staticmethod
+    def _is_read_only(path):
+        "Whether the path is one of our own files that can't be written"
+        return path in STATS_FILES or (path.startswith(CONTROL_DIR + "/")
+                                       and path != PROFILE_FILE)
+
+    def _contents(self, path):
+        "Returns the current contents of a file"
+        if path.startswith(CONTROL_DIR + "/"):
+            return self._control_contents(path)
+        if path in STATS_FILES:
+            # getattr probably just made it, use that to get the size right
+            return (self._leftovers.pop(path)
+                    or STATS_FILES[path](self.get_stats()))
+        if path in self.tmpfiles:
+            return self.tmpfiles[path]
+        try:
+            target = self._get_path(path)
+        except (KeyError, TypeError):
+            parent, child = path.rsplit("/", 1)
+            try:
+                target = self._get_path(parent)
+            except KeyError:
+                raise FuseOSError(ENOENT)
+            if isinstance(target, DeviceAttribute):
+                # the next stat of the attribute reads it again
+                self._readings.invalidate(parent)
+                # getattr probably just read it, no need to do it again
+                contents = self._leftovers.pop(path)
+                if contents is None:
+                    contents = self._attribute_file(target, child)
+                return contents
+            raise FuseOSError(ENOENT)
+        if isinstance(target, DeviceProperty):
+            return self._property_node(target)[0]
+        if isinstance(target, DeviceCommand):
+            return self._command_node(target)[0]
+        raise FuseOSError(EISDIR)
+
+    def _child_node(self, target, name):
+        """Returns the node for a child of target, but only if it can be
+        made from what target has already loaded. Otherwise None."""
+        if isinstance(target, (TangoDict, ServersDict, ServerDict,
+                               InstanceDict, DomainsDict, FamiliesDict,
+                               DeviceDict)):
+            # children are always plain directories
+            return self.make_node(mode=stat.S_IFDIR, size=0)
+        if isinstance(target, AttributesDict):
+            # config comes from the bulk info loaded with the list
+            return self._attribute_node(target.get_info(name))
+        if isinstance(target, PropertiesDict):
+            prop = target[name]
+            if prop.is_loaded:
+                return self._property_node(prop)[1]
+        elif isinstance(target, CommandsDict):
+            return self._command_node(target[name])[1]
+        elif isinstance(target, DeviceAttribute):
+            if name.partition(".")[0] not in DYNAMIC_ATTRIBUTE_FILES:
+                value = str(getattr(target, name))
+                return self.make_node(mode=stat.S_IFREG, size=len(value))
+
     # # #  Filesystem API  # # #
 
+    def __call__(self, op, path, *args):
+        "FUSE calls everything through here"
+        with tracing.span(op, "fuse", path=path):
+            if profiler.running:
+                return profiler.runcall(self._call, op, path, *args)
+            return self._call(op, path, *args)
+
+    def _call(self, op, path, *args):
+        if self.log.isEnabledFor(logging.DEBUG):
+            return LoggingMixIn.__call__(self, op, path, *args)
+        # skip formatting the arguments for nothing
+        return getattr(self, op)(path, *args)
+
     def getattr(self, path, fh=None):
         "getattr gets run all the time"
+        try:
+            # readdir may already have found out what we need
+            return self._stats[path]
+        except KeyError:
+            return self._getattr(path)
+
+    def _getattr(self, path):
         # TODO: refactor, this is too messy
         # Maybe some of this stuff can be moved into open?
         # Apparently, if something is read several times quickly,
         # getattr may not be called in subsequent calls. Caching?
+        if path in STATS_FILES:
+            contents = STATS_FILES[path](self.get_stats())
+            self._leftovers[path] = contents
+            return self.make_node(mode=READ_ONLY_FILE, size=len(contents))
+        if path == CONTROL_DIR:
+            return self.make_node(mode=stat.S_IFDIR, size=0)
+        if path.startswith(CONTROL_DIR + "/"):
+            contents = self._control_contents(path)
+            mode = READ_ONLY_FILE
+            if path == PROFILE_FILE:
+                mode |= stat.S_IWUSR
+            return self.make_node(mode=mode, size=len(contents))
         try:
             # Firs check if the path is directly accessible
             target = self._get_path(path)
@@ -91,41 +445,48 @@ class TangoFS(LoggingMixIn, Operations):
                 parent, child = path.rsplit("/", 1)
                 target = self._get_path(parent)
                 if isinstance(target, DeviceAttribute):
-                    if path in self.tmp:
-                        value = self.tmp[path]
-                    else:
-                        # store the value in tmp so we don't have to read
-                        # it again in the read method. Also, otherwise the
-                        # size might be wrong.
-                        if child in ("value", "w_value"):
-                            data = getattr(target, child)
-                            plugins = get_plugins(target.info, data)
-                            try:
-                                value = plugins[0].convert(data)
-                            except Exception as e:
-                                self.log.error("Decoding failed: %s", e)
-                            # TODO: handle the case when more than one plugin
-                            # matches. I guess each plugin need to give a unique
-                            # file extension or something.
+                    value_file = VALUE_FILE.match(child)
+                    if self.lazy_size and value_file:
+                        # Don't read the attribute just to stat it, it
+                        # will be read when the file is opened.
+                        name, spec, extension = value_file.groups()
+                        plugin, _ = self._value_plugin(target, spec,
+                                                       extension)
+                        if self.direct_io:
+                            size = 0  # the kernel won't care anyway
                         else:
-                            value = str(getattr(target, child))
-                        # TODO: How about quality?
-                    self.tmp[path] = value
+                            size = estimate_size(target.info, plugin)
+                        return self.make_node(mode=stat.S_IFREG, size=size)
+                    reading, shared = None, False
+                    if value_file:
+                        reading, shared = self._shared_reading(parent,
+                                                               target)
+                    value = self._attribute_file(target, child, reading)
+                    if not shared:
+                        # keep the value around so that we don't have to
+                        # read it again if the file is opened right away.
+                        # Also, otherwise the size might be wrong. But
+                        # a value from an earlier reading must not be
+                        # what opening the file gives.
+                        self._leftovers[path] = value
                     size = len(value)
                     mode = stat.S_IFREG
                     return self.make_node(mode=mode, size=size)
                 # OK, what we're looking for is not in the DB. Let's
                 # check if there is any pending creation operations going
                 # on
-                elif path in self.tmp:
-                    if self.tmp[path] == PROPERTY:
+                elif path in self.pending:
+                    if self.pending[path] == PROPERTY:
                         # This means the user is creating a property
-                        del self.tmp[path]
-                    elif self.tmp[path] == SERVER:
+                        del self.pending[path]
+                    elif self.pending[path] == SERVER:
                         self.log.debug("wheee")
                         return self.make_node(mode=stat.S_IFDIR, size=0)
                     # ... insert other types of pending operations ...
                     return self.make_node(mode=stat.S_IFREG)
+                elif path in self.tmpfiles:
+                    return self.make_node(mode=stat.S_IFREG,
+                                          size=len(self.tmpfiles[path]))
                 else:
                     # none
                     raise FuseOSError(ENOENT)
@@ -134,19 +495,11 @@ class TangoFS(LoggingMixIn, Operations):
 
         # properties correspond to files
         if type(target) == DeviceProperty:
-            # use last history date as timestamp
-            # Fixme: potential performance issue, commented out for now
-            timestamp = parser.parse(target.history[-1].get_date())
-            value = self.tmp[path] = "\n".join(target.value) + "\n"
-            return self.make_node(
-                mode=stat.S_IFREG, timestamp=unix_time(timestamp),
-                size=len(value))
+            return self._property_node(target)[1]
 
         # commands are executables
         elif isinstance(target, DeviceCommand):
-            exe = self.tmp[path] = EXE.format(device=target.devicename,
-                                              command=target.name)
-            return self.make_node(mode=stat.S_IFREG | 755, size=len(exe))
+            return self._command_node(target)[1]
 
         # If a device is exported, mark the node as executable
         elif isinstance(target, DeviceDict):
@@ -160,42 +513,59 @@ class TangoFS(LoggingMixIn, Operations):
             return self.make_node(mode=mode, timestamp=unix_time(timestamp))
 
         elif isinstance(target, DeviceAttribute):
-            # set mode accordingbi to whether the attr is read/writable
-            mode = stat.S_IFDIR | stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH
-            if target.writable != PyTango.AttrWriteType.READ:
-                mode |= (stat.S_IWRITE | stat.S_IWGRP | stat.S_IWOTH)
-            return self.make_node(mode=mode)
+            return self._attribute_node(target.info)
 
         # otherwise show it as a directory
         else:
             return self.make_node(mode=stat.S_IFDIR, size=0)
 
     def readdir(self, path, fh):
-        if path in self.tmp:
+        if path in self.pending:
             return [".", "."]
+        if path == CONTROL_DIR:
+            names = [PROFILE_FILE.rsplit("/", 1)[1]] + list(profiler.results)
+            return [".", ".."] + [(name, None, 0) for name in names]
         try:
             target = self._get_path(path)
         except PyTango.DevFailed:
             return None
+        except KeyError:
+            raise FuseOSError(ENOENT)
         # Since slashes are not allowed in file names, we encode
         # them as percent signs (%) to sanitize device names
         nodes = [name.replace("/", "%") for name in target.keys()]
         # if isinstance(target, DeviceDict):
         #     nodes.append(".info")
-        if isinstance(target, AttributesDict):
-            for i, node in enumerate(nodes):
-                if target[node].disp_level == PyTango.DispLevel.EXPERT:
-                    nodes[i] = "." + node
+        entries = []
+        for node in nodes:
+            # Fill in stat info for the entries where we already have
+            # it, so that e.g. "ls -l" doesn't need a getattr round
+            # trip to the backend for each one.
+            try:
+                attrs = self._child_node(target, node)
+            except (KeyError, PyTango.DevFailed) as e:
+                self.log.debug("No stat info for %s: %s", node, e)
+                attrs = None
+            if isinstance(target, AttributesDict):
+                info = target.get_info(node)
+                if info.disp_level == PyTango.DispLevel.EXPERT:
+                    node = "." + node
+            if attrs:
+                self._stats[path.rstrip("/") + "/" + node] = attrs
+            entries.append((node, attrs, 0))
+        if target is self.tree:
+            entries.extend((name[1:], None, 0)
+                           for name in sorted(STATS_FILES) + [CONTROL_DIR])
         # if isinstance(target, PropertiesDict):
         #     nodes.extend([node + ".history" for node in nodes])
-        return [".", ".."] + nodes
+        return [".", ".."] + entries
 
     def mkdir(self, path, mode):
         parent, child = path.rsplit("/", 1)
 
-        if parent in self.tmp:
+        if parent in self.pending:
             # we are creating something
-            thing = self.tmp[parent]
+            thing = self.pending[parent]
             if thing == SERVER:
                 server = parent.rsplit("/", 1)[-1]
                 self.tree["servers"].add(server, child)
@@ -205,23 +575,29 @@ class TangoFS(LoggingMixIn, Operations):
         else:
             target = self._get_path(parent)
             if isinstance(target, ServersDict):
-                self.tmp[path] = SERVER
+                self.pending[path] = SERVER
             elif isinstance(target, InstanceDict):
-                self.tmp[path] = CLASS
+                self.pending[path] = CLASS
             elif isinstance(target, ClassDict):  # creating a device
                 target.add([child.replace("%", "/")])
+        self._invalidate(parent)
 
     def read(self, path, size, offset, fh):
-        if path in self.tmp:
-            return self.tmp[path][offset:offset+size]
-        # As it works right now, we prepare the value in getattr
-        # so it should always be available at this point.
-        # This is probably not the best way, since it means we're
-        # reading things even if the user is just writing.
-        raise FuseOSError(ENOENT)
+        try:
+            handle = self.handles[fh]
+        except KeyError:
+            raise FuseOSError(EBADF)
+        if handle.contents is None:
+            # opened for writing only, but read anyway
+            handle.contents = self._contents(path)
+        return handle.chunk(offset, size)
 
     def write(self, path, data, offset, fh):
         "Write data to a file"
+        if path == PROFILE_FILE:
+            return self._control_profile(data)
+        self._stats.invalidate(path)
+        self._leftovers.invalidate(path)
         try:
             target = self._get_path(path)
         except KeyError:
@@ -232,14 +608,15 @@ class TangoFS(LoggingMixIn, Operations):
                 # creating a new property
                 if SEDTMP.match(prop):
                     if offset:  # change/append
-                        olddata = self.tmp[path]
+                        olddata = self.tmpfiles[path]
                         newdata = (olddata[:offset] + data +
                                    olddata[offset + len(data):])
-                        self.tmp[path] = newdata
+                        self.tmpfiles[path] = newdata
                     else:
-                        self.tmp[path] = data
+                        self.tmpfiles[path] = data
                 else:
                     target.add({str(prop): data.strip().split("\n")})
+                    self._invalidate(parent)
         except TypeError:
             # a bit crude, but since DeviceAttribute is not a dict
             # we can't access things like e.g. ["value"]
@@ -251,6 +628,7 @@ class TangoFS(LoggingMixIn, Operations):
                     try:
                         value = PyTango.utils.seqStr_2_obj(data, dtype)
                         setattr(target, attr, value)
+                        self._readings.invalidate(parent)
                         return len(data)
                     except (ValueError, PyTango.DevFailed) as e:
                         self.log.debug(e)
@@ -279,17 +657,19 @@ class TangoFS(LoggingMixIn, Operations):
         # be inefficient. This feels a bit hacky, though...
         parent, child = os.path.split(path)
         if SEDTMP.match(child):
-            self.tmp[path] = ""
+            self.tmpfiles[path] = ""
         else:
-            self.tmp[path] = PROPERTY
-        return 0
+            self.pending[path] = PROPERTY
+        return self.handles.open(path)
 
     def unlink(self, path):
         # remove a file
-        self.tmp.pop(path)
+        if self.tmpfiles.pop(path, None) is not None:
+            return
         target = self._get_path(path)
         if isinstance(target, DeviceProperty):
             target.delete()
+        self._invalidate(os.path.dirname(path))
 
     def rmdir(self, path):
         """Removing a directory should delete the corresponding
@@ -301,14 +681,38 @@ class TangoFS(LoggingMixIn, Operations):
         target = self._get_path(path)
         if isinstance(target, (InstanceDict, DeviceDict)):
             target.delete()
+        self._invalidate(os.path.dirname(path))
+
+    def _control_profile(self, data):
+        "Start or stop profiling"
+        command = data.strip()
+        if command == "start":
+            profiler.start()
+        elif command == "stop":
+            for name in profiler.stop():
+                self.log.info("Saving profile %s/%s", CONTROL_DIR, name)
+        else:
+            raise FuseOSError(EINVAL)
+        return len(data)
 
     def truncate(self, path, length, fh=None):
+        if self._is_read_only(path):
+            raise FuseOSError(EACCES)
+        if path == PROFILE_FILE:
+            return
         # I don't think this will be very useful
-        pass
+        self._stats.invalidate(path)
 
     def open(self, path, flags):
-        return flags
-
+        write_only = (flags & (os.O_WRONLY | os.O_RDWR)) == os.O_WRONLY
+        if self._is_read_only(path) and flags & (os.O_WRONLY | os.O_RDWR):
+            raise FuseOSError(EACCES)
+        contents = None
+        if not write_only:
+            # The contents are read once, here, and stay the same for
+            # as long as the file is open.
+            contents = self._contents(path)
+        return self.handles.open(path, contents)
 
     def flush(self, path, fh):
         pass
@@ -316,10 +720,8 @@ class TangoFS(LoggingMixIn, Operations):
     def sync(self, path, fdatasync, fh):
         pass
 
-    def release(self, path, flags):
-        if path in self.tmp:
-            del self.tmp[path]
-        pass
+    def release(self, path, fh):
+        self.handles.release(fh)
 
     def mknod(*args):
         pass
@@ -330,16 +732,17 @@ class TangoFS(LoggingMixIn, Operations):
 
         oldparent, oldchild = os.path.split(oldpath)
         newparent, newchild = os.path.split(newpath)
-        if oldpath in self.tmp and SEDTMP.match(oldchild):
+        if oldpath in self.tmpfiles and SEDTMP.match(oldchild):
             # we are renaming a temporary file!
             # presumably it's created by sed
-            value = self.tmp.pop(oldpath)
+            value = self.tmpfiles.pop(oldpath)
             if SEDTMP.match(newchild):
                 # not sure if this ever happens
-                self.tmp[newpath] = value
+                self.tmpfiles[newpath] = value
                 return 0
             else:
                 value = value.strip().split("\n")
+                self._stats.invalidate(newpath)
                 target = self._get_path(newpath)
                 if isinstance(target, DeviceProperty):
                     target.value = value
@@ -347,6 +750,8 @@ class TangoFS(LoggingMixIn, Operations):
             source = self._get_path(oldpath)
             if isinstance(source, (DeviceProperty, InstanceDict)):
                 source.rename(str(newchild))
+                self._invalidate(oldparent)
+                self._invalidate(newparent)
             else:
                 # immovable object
                 raise FuseOSError(ENOENT)
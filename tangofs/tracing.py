@@ -0,0 +1,139 @@
+"""
+Optional tracing of what the filesystem spends its time on.
+
+When enabled, each filesystem operation becomes a span, and each
+backend call (made through an ObjectWrapper) during it becomes a child
+span. Only a sample of the operations is traced, and only the latest
+spans are kept, in a ring buffer. They can be dumped in the Chrome
+trace event format, and looked at in e.g. chrome://tracing.
+
+Tracing is off unless enable() is called. While it's off, span()
+costs next to nothing.
+"""
+
+from collections import deque
+import json
+import os
+import random
+from thread import get_ident
+from threading import Lock, local
+from time import time
+
+
+SAMPLE_RATE = 1.0  # fraction of operations to trace
+BUFFER_SIZE = 100000  # number of spans to keep
+
+
+class NoSpan(object):
+
+    "Stands in for a span that is not recorded"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+NO_SPAN = NoSpan()
+
+
+class Unsampled(object):
+
+    "An operation that is not traced, and neither is anything inside it"
+
+    def __init__(self, stack):
+        self.stack = stack
+
+    def __enter__(self):
+        self.stack.append(None)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.pop()
+
+
+class Span(object):
+
+    "A traced piece of work, from entering to exiting it"
+
+    def __init__(self, tracer, stack, name, category, args):
+        self.tracer = tracer
+        self.stack = stack
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.stack.append(self)
+        self.start = time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time()
+        self.stack.pop()
+        if exc_type is not None:
+            self.args["error"] = repr(exc_value)
+        self.tracer.record(self, end)
+
+
+class Tracer(object):
+
+    def __init__(self, sample_rate=SAMPLE_RATE, size=BUFFER_SIZE):
+        self.sample_rate = sample_rate
+        self._events = deque(maxlen=size)
+        self._local = local()
+        self._lock = Lock()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def span(self, name, category, **args):
+        stack = self._stack()
+        if stack:
+            if stack[-1] is None:
+                return NO_SPAN  # part of an operation that isn't traced
+        elif random.random() >= self.sample_rate:
+            return Unsampled(stack)
+        return Span(self, stack, name, category, args)
+
+    def record(self, span, end):
+        # a "complete" event, times in microseconds
+        event = {"name": span.name, "cat": span.category, "ph": "X",
+                 "ts": span.start * 1e6, "dur": (end - span.start) * 1e6,
+                 "pid": os.getpid(), "tid": get_ident(), "args": span.args}
+        with self._lock:
+            self._events.append(event)
+
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def dump(self, f):
+        "Write the recorded spans to a file, as Chrome trace JSON"
+        json.dump({"traceEvents": self.events(),
+                   "displayTimeUnit": "ms"}, f)
+
+
+_tracer = None
+
+
+def enable(sample_rate=SAMPLE_RATE, size=BUFFER_SIZE):
+    "Start tracing"
+    global _tracer
+    _tracer = Tracer(sample_rate, size)
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, category, **args):
+    "A context manager tracing whatever happens inside it, if enabled"
+    if _tracer is None:
+        return NO_SPAN
+    return _tracer.span(name, category, **args)
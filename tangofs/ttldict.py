@@ -2,14 +2,23 @@
 TTL dictionary
 
 Tricks / features:
- - calling len() will remove expired keys
+ - expiry times are kept in a heap, so expired keys are removed in
+   O(log n) each, as a side effect of other operations, instead of by
+   checking every key
+ - optionally limited in size, evicting the least recently used keys
+ - subclasses can normalize keys (e.g. ignore case) by overriding
+   _normalize(); the key as first set is kept and returned by iteration
+ - lookups don't lock or look at the clock when there is nothing that
+   could expire or be evicted (no TTL and no max size)
  - __repr__() might show expired values, doesn't remove expired ones
 """
 
 __all__ = ['TTLDict']
-__version__ = '0.0.4'
+__version__ = '0.1.0'
 
-from collections import MutableMapping
+from collections import MutableMapping, OrderedDict
+from heapq import heappush, heappop, heapify
+from itertools import count
 from threading import RLock
 import time
 
@@ -18,44 +27,86 @@ class TTLDict(MutableMapping):
     """
     Dictionary with TTL
     Extra args and kwargs are passed to initial .update() call
+    If max_size is given, the least recently used keys are evicted
+    when the dict grows beyond it.
     """
     def __init__(self, default_ttl, *args, **kwargs):
         self._default_ttl = default_ttl
-        self._values = {}
+        self._max_size = kwargs.pop("max_size", None)
+        # normalized key -> (expire, value, key), least recently used first
+        self._values = OrderedDict()
+        self._heap = []  # (expire, seq, normalized key), may be stale
+        self._seq = count()
         self._lock = RLock()
         self.update(*args, **kwargs)
 
     def __repr__(self):
-        return '<TTLDict@%#08x; ttl=%r, v=%r;>' % (id(self), self._default_ttl, self._values)
+        return '<TTLDict@%#08x; ttl=%r, v=%r;>' % (id(self), self._default_ttl, dict(self._values))
+
+    @staticmethod
+    def _normalize(key):
+        "Override to make different keys count as the same"
+        return key
+
+    def _set(self, nkey, expire, value, key):
+        self._values[nkey] = (expire, value, key)
+        if expire is not None:
+            heappush(self._heap, (expire, next(self._seq), nkey))
+            if len(self._heap) > 2 * len(self._values) + 16:
+                self._compact()
+
+    def _compact(self):
+        "Rebuild the heap without stale entries"
+        self._heap = [(item[0], next(self._seq), nkey)
+                      for nkey, item in self._values.items()
+                      if item[0] is not None]
+        heapify(self._heap)
+
+    def _purge(self, now=None):
+        "Remove all expired keys"
+        heap = self._heap
+        if not heap:
+            return
+        if now is None:
+            now = time.time()
+        while heap and heap[0][0] < now:
+            expire, _seq, nkey = heappop(heap)
+            item = self._values.get(nkey)
+            # the key may have been removed or gotten a new expiry
+            # time since this entry was pushed
+            if item is not None and item[0] == expire:
+                del self._values[nkey]
 
     def set_ttl(self, key, ttl, now=None):
         """ Set TTL for the given key """
         if now is None:
             now = time.time()
+        nkey = self._normalize(key)
         with self._lock:
-            _expire, value = self._values[key]
-            self._values[key] = (now + ttl, value)
+            _expire, value, key = self._values[nkey]
+            self._set(nkey, now + ttl, value, key)
 
     def get_ttl(self, key, now=None):
         """ Return remaining TTL for a key """
         if now is None:
             now = time.time()
         with self._lock:
-            expire, _value = self._values[key]
+            expire = self._values[self._normalize(key)][0]
             return expire - now
 
     def expire_at(self, key, timestamp):
         """ Set the key expire timestamp """
+        nkey = self._normalize(key)
         with self._lock:
-            _expire, value = self._values[key]
-            self._values[key] = (timestamp, value)
+            _expire, value, key = self._values[nkey]
+            self._set(nkey, timestamp, value, key)
 
     def is_expired(self, key, now=None, remove=False):
         """ Check if key has expired """
         with self._lock:
             if now is None:
                 now = time.time()
-            expire, _value = self._values[key]
+            expire = self._values[self._normalize(key)][0]
             if expire is None:
                 return False
             expired = expire < now
@@ -65,29 +116,61 @@ class TTLDict(MutableMapping):
 
     def __len__(self):
         with self._lock:
-            for key in self._values.keys():
-                self.is_expired(key, remove=True)
+            self._purge()
             return len(self._values)
 
     def __iter__(self):
         with self._lock:
-            for key in self._values.keys():
-                if not self.is_expired(key, remove=True):
-                    yield key
+            self._purge()
+            keys = [item[2] for item in self._values.itervalues()]
+        return iter(keys)
+
+    def __contains__(self, key):
+        nkey = self._normalize(key)
+        if self._max_size is None and not self._heap:
+            # nothing can expire or be evicted, and dict lookups are
+            # atomic, so there's no need to lock
+            return nkey in self._values
+        with self._lock:
+            self._purge()
+            return nkey in self._values
 
     def __setitem__(self, key, value):
+        nkey = self._normalize(key)
         with self._lock:
             if self._default_ttl is None:
                 expire = None
             else:
                 expire = time.time() + self._default_ttl
-            self._values[key] = (expire, value)
+            old = self._values.pop(nkey, None)  # move it to the end
+            if old is not None:
+                key = old[2]  # keep the key as it was first set
+            self._set(nkey, expire, value, key)
+            if self._max_size is not None:
+                if len(self._values) > self._max_size:
+                    self._purge()
+                while len(self._values) > self._max_size:
+                    self._values.popitem(last=False)
 
     def __delitem__(self, key):
+        nkey = self._normalize(key)
         with self._lock:
-            del self._values[key]
+            del self._values[nkey]
 
     def __getitem__(self, key):
+        nkey = self._normalize(key)
+        if self._max_size is None and not self._heap:
+            return self._values[nkey][1]  # see __contains__
+        with self._lock:
+            self._purge()
+            item = self._values[nkey]
+            if self._max_size is not None:
+                # mark as recently used
+                del self._values[nkey]
+                self._values[nkey] = item
+            return item[1]
+
+    def clear(self):
         with self._lock:
-            self.is_expired(key, remove=True)
-            return self._values[key][1]
+            self._values.clear()
+            self._heap = []